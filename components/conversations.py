@@ -3,47 +3,77 @@ Conversation components for Tebbi Analytics Dashboard
 """
 
 import streamlit as st
-from datetime import datetime
+import pandas as pd
 from typing import Dict, List, Any
-from utils.data_processing import get_user_display_name, organize_conversations_by_user, process_user_options
+from utils.data_processing import get_user_display_name, build_conversation_index, conversations_cache_key, report_cache_key, DEBUG_UI
 
+# Số messages render mỗi lần trong conversation browser
+CONVERSATION_PAGE_SIZE = 50
+
+USER_MSG_TEMPLATE = """
+<div class="conversation-msg user-msg">
+    <div style="display: flex; justify-content: space-between; margin-bottom: 5px;">
+        <strong>👤 {name}</strong>
+        <small style="color: #666;">{time}</small>
+    </div>
+    {content}
+</div>
+"""
+
+AI_MSG_TEMPLATE = """
+<div class="conversation-msg ai-msg">
+    <div style="display: flex; justify-content: space-between; margin-bottom: 5px;">
+        <strong>🤖 AI Assistant</strong>
+        <small style="color: #666;">{time}</small>
+    </div>
+    {content}
+</div>
+"""
+
+def _load_older_messages(offset_key: str, start: int):
+    """Callback: lùi cửa sổ hiển thị thêm một trang messages"""
+    st.session_state[offset_key] = max(0, start - CONVERSATION_PAGE_SIZE)
+
+@st.fragment
 def display_conversations_browser(conversations_data: List[dict], report_data: dict = None):
-    """Hiển thị trình duyệt conversations"""
+    """Hiển thị trình duyệt conversations (fragment: đổi user/thread chỉ rerun phần này)"""
     if not conversations_data:
         st.warning("⚠️ Không có dữ liệu conversations")
         return
     
     st.subheader("💬 Conversations Browser")
     
-    # Organize by user
-    users_conversations = organize_conversations_by_user(conversations_data)
+    # Organize by user + user options, cache qua các lần rerun do đổi selectbox
+    threads_per_user = report_data.get('threads_per_user', {}) if report_data else {}
+    user_positions, user_options = build_conversation_index(
+        conversations_cache_key(conversations_data),
+        report_cache_key(report_data),
+        conversations_data,
+        threads_per_user
+    )
     
-    if not users_conversations:
+    if not user_positions:
         st.warning("⚠️ Không tìm thấy conversations")
         return
     
-    # User selector với tên đầy đủ - lấy thông tin từ analytics data
-    threads_per_user = report_data.get('threads_per_user', {}) if report_data else {}
-    user_options = process_user_options(users_conversations, threads_per_user)
-    
-    selected_user_display = st.selectbox(
+    user_labels = [label for label, _ in user_options]
+    user_idx = st.selectbox(
         "👤 Chọn User:",
-        list(user_options.keys()),
+        range(len(user_labels)),
+        format_func=user_labels.__getitem__,
         help="Chọn user để xem conversations"
     )
     
-    if not selected_user_display:
+    if user_idx is None:
         return
     
-    selected_user_id = user_options[selected_user_display]
-    user_convs = users_conversations[selected_user_id]
+    selected_user_id = user_options[user_idx][1]
+    user_convs = [conversations_data[i] for i in user_positions[selected_user_id]]
     
-    # Show user info - Lấy từ analytics data
-    user_metadata = {}
-    
-    # Lấy user info từ analytics data (threads_per_user)
-    if selected_user_id in threads_per_user:
-        user_metadata = threads_per_user[selected_user_id].get('user_info', {})
+    # Show user info - Lấy từ analytics data (threads_per_user), tra dict một lần
+    analytics_user_data = threads_per_user.get(selected_user_id)
+    user_stats = analytics_user_data or {}
+    user_metadata = user_stats.get('user_info') or {}
     
     with st.expander("👤 User Information", expanded=True):
         col1, col2 = st.columns([2, 1])
@@ -54,7 +84,6 @@ def display_conversations_browser(conversations_data: List[dict], report_data: d
             st.write(f"**Username:** {user_metadata.get('username', 'N/A')}")
             st.write(f"**Email:** {user_metadata.get('email', 'N/A')}")
             st.write(f"**Phone:** {user_metadata.get('phoneNumber', user_metadata.get('phone', 'N/A'))}")
-            user_stats = threads_per_user.get(selected_user_id, {})
             st.write(f"**💬 Tổng messages:** {user_stats.get('total_messages', 'N/A')}")
             st.write(f"**💬 Messages của user:** {user_stats.get('total_user_messages', 'N/A')}")
         
@@ -62,40 +91,39 @@ def display_conversations_browser(conversations_data: List[dict], report_data: d
             st.metric("📝 Total Threads", len(user_convs))
         
         # Debug info to see what's available
-        with st.expander("🔍 Debug - User Data Sources", expanded=False):
-            st.write("**User info từ analytics data:**")
-            if selected_user_id in threads_per_user:
-                analytics_user_data = threads_per_user[selected_user_id]
-                st.json(analytics_user_data)
-            else:
-                st.write("Không tìm thấy trong analytics data")
-            
-            st.write("**User metadata hiện tại:**")
-            st.json(user_metadata)
-            
-            st.write("**Sample conversation metadata:**")
-            if user_convs:
-                sample_metadata = user_convs[0].get('metadata', {})
-                st.json(sample_metadata)
+        if DEBUG_UI:
+            with st.expander("🔍 Debug - User Data Sources", expanded=False):
+                st.write("**User info từ analytics data:**")
+                if analytics_user_data is not None:
+                    st.json(analytics_user_data)
+                else:
+                    st.write("Không tìm thấy trong analytics data")
+                
+                st.write("**User metadata hiện tại:**")
+                st.json(user_metadata)
+                
+                st.write("**Sample conversation metadata:**")
+                if user_convs:
+                    sample_metadata = user_convs[0].get('metadata', {})
+                    st.json(sample_metadata)
     
     # Thread selector
-    thread_options = {}
-    for conv in user_convs:
-        thread_id = conv.get('thread_id', '')
-        message_count = conv.get('message_count', 0)
-        updated_at = conv.get('updated_at', '')[:10] if conv.get('updated_at') else 'N/A'
-        thread_options[f"Thread {thread_id}... ({message_count} msg) - {updated_at}"] = conv
+    thread_labels = [
+        f"Thread {conv.get('thread_id', '')}... ({conv.get('message_count', 0)} msg) - {(conv.get('updated_at') or '')[:10] or 'N/A'}"
+        for conv in user_convs
+    ]
     
-    selected_thread_display = st.selectbox(
+    thread_idx = st.selectbox(
         "💬 Chọn Thread:",
-        list(thread_options.keys()),
+        range(len(thread_labels)),
+        format_func=thread_labels.__getitem__,
         help="Chọn thread để xem conversation chi tiết"
     )
     
-    if not selected_thread_display:
+    if thread_idx is None:
         return
     
-    selected_conv = thread_options[selected_thread_display]
+    selected_conv = user_convs[thread_idx]
     
     # Display conversation
     st.markdown("---")
@@ -109,45 +137,40 @@ def display_conversations_browser(conversations_data: List[dict], report_data: d
     if not conversation:
         st.warning("⚠️ Không có messages hợp lệ")
         return
-        
-    # Display messages
-    for msg in conversation:
-        role = msg.get('role', '').lower()
-        content = msg.get('content', '')
-        timestamp = msg.get('timestamp', '')
-        
-        # Format timestamp
-        time_display = ""
-        if timestamp:
-            try:
-                dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                time_display = dt.strftime('%H:%M:%S')
-            except:
-                time_display = timestamp[:8] if timestamp else ""
-        
-        if role in ['user', 'human']:
-            # Lấy user name từ analytics data
-            user_info_for_display = {}
-            if selected_user_id in threads_per_user:
-                user_info_for_display = threads_per_user[selected_user_id].get('user_info', {})
-            user_name = get_user_display_name(user_info_for_display, selected_user_id)
-            
-            st.markdown(f"""
-            <div class="conversation-msg user-msg">
-                <div style="display: flex; justify-content: space-between; margin-bottom: 5px;">
-                    <strong>👤 {user_name}</strong>
-                    <small style="color: #666;">{time_display}</small>
-                </div>
-                {content}
-            </div>
-            """, unsafe_allow_html=True)
-        elif role in ['assistant', 'ai', 'bot']:
-            st.markdown(f"""
-            <div class="conversation-msg ai-msg">
-                <div style="display: flex; justify-content: space-between; margin-bottom: 5px;">
-                    <strong>🤖 AI Assistant</strong>
-                    <small style="color: #666;">{time_display}</small>
-                </div>
-                {content}
-            </div>
-            """, unsafe_allow_html=True) 
\ No newline at end of file
+
+    # Chỉ render cửa sổ messages gần nhất, bấm "Load older" để mở rộng dần về trước
+    offset_key = f"conv_offset_{selected_conv.get('thread_id', '')}"
+    start = st.session_state.get(offset_key, max(0, len(conversation) - CONVERSATION_PAGE_SIZE))
+    if start > 0:
+        st.caption(f"Đang hiển thị {len(conversation) - start}/{len(conversation)} messages gần nhất")
+        st.button(
+            "⬆️ Load older",
+            key=f"load_older_{offset_key}",
+            on_click=_load_older_messages,
+            args=(offset_key, start)
+        )
+
+    # Display messages - parse timestamp một lần cho cả cửa sổ, gộp thành một khối HTML
+    df_msgs = pd.DataFrame(conversation[start:]).reindex(columns=['role', 'content', 'timestamp'])
+    df_msgs['role'] = df_msgs['role'].fillna('').str.lower()
+    df_msgs['content'] = df_msgs['content'].fillna('')
+    timestamps = df_msgs['timestamp'].fillna('').astype(str)
+    df_msgs['time_display'] = (
+        pd.to_datetime(timestamps, errors='coerce', utc=True, format='ISO8601', cache=True)
+        .dt.strftime('%H:%M:%S')
+        .fillna(timestamps.str.slice(0, 8))
+    )
+
+    # Lấy user name từ analytics data
+    user_name = get_user_display_name(user_metadata, selected_user_id)
+
+    html_parts = [
+        USER_MSG_TEMPLATE.format(name=user_name, time=time_display, content=content)
+        if role in ('user', 'human') else
+        AI_MSG_TEMPLATE.format(time=time_display, content=content)
+        for role, content, time_display in zip(df_msgs['role'], df_msgs['content'], df_msgs['time_display'])
+        if role in ('user', 'human', 'assistant', 'ai', 'bot')
+    ]
+
+    if html_parts:
+        st.markdown("\n".join(html_parts), unsafe_allow_html=True)
\ No newline at end of file
@@ -2,49 +2,360 @@
 Metrics components for Tebbi Analytics Dashboard
 """
 
+import math
 import streamlit as st
 from datetime import datetime
-from typing import Dict, Optional, Any
+from typing import Dict, List, Optional, Any, Tuple
 import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+from utils.data_processing import tool_stats_cache_key, report_cache_key, build_users_frame
+from components.charts import (
+    create_threads_timeline_chart,
+    create_user_distribution_chart,
+    create_top_thread_users_chart,
+    create_top_message_users_chart,
+    create_user_message_distribution_chart,
+    create_user_message_chart
+)
 
-def display_overview_metrics(report: Dict[str, Any]):
-    """Hiển thị metrics tổng quan"""
-    summary = report.get('summary', {})
+# Trên ngưỡng này timeline chuyển sang WebGL (Scattergl) để browser không nghẽn khi vẽ SVG
+WEBGL_POINT_THRESHOLD = 2000
+# Số dòng mỗi trang của bảng detailed tool calls
+DETAILED_PAGE_SIZE = 500
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_tools_df(create_lead: int, send_html_email: int) -> pd.DataFrame:
+    """DataFrame cho pie chart tool calls, chỉ gồm các tool có lượt gọi"""
+    tool_data = []
+    if create_lead > 0:
+        tool_data.append({'Tool': 'Create Lead', 'Count': create_lead, 'Color': '#FF6B6B'})
+    if send_html_email > 0:
+        tool_data.append({'Tool': 'Send HTML Email', 'Count': send_html_email, 'Color': '#4ECDC4'})
+    return pd.DataFrame(tool_data)
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_timeline_df(stats_key: str, _tool_calls_by_date: dict) -> pd.DataFrame:
+    """DataFrame tool calls theo ngày, Date dạng chuỗi YYYY-MM-DD, mới nhất trước (cache theo stats_key)"""
+    # Key dạng YYYY-MM-DD nên sort chuỗi trong Python là đúng thứ tự ngày, khỏi sort DataFrame
+    items = sorted(_tool_calls_by_date.items(), reverse=True)
+    return pd.DataFrame({
+        'Date': [date_str for date_str, _ in items],
+        'Create Lead': [stats.get('create_lead', 0) for _, stats in items],
+        'Send HTML Email': [stats.get('send_html_email', 0) for _, stats in items],
+        'Total': [stats.get('total', 0) for _, stats in items]
+    })
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_threads_by_date_df(report_key: str, _threads_by_date: dict) -> pd.DataFrame:
+    """Bảng threads theo ngày, mới nhất trước (cache theo report_key)"""
+    return pd.DataFrame(sorted(_threads_by_date.items(), reverse=True), columns=['Date', 'Threads'])
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_top_users_df(report_key: str, _top_users: List[dict]) -> pd.DataFrame:
+    """Bảng top users dựng vectorized từ list top_users (cache theo report_key)"""
+    df = pd.json_normalize(_top_users, max_level=1).reindex(columns=[
+        'user_id', 'user_info.username', 'user_info.email', 'user_info.name', 'thread_count', 'avg_messages_per_thread', 'total_messages'
+    ])
+    return pd.DataFrame({
+        'User ID': df['user_id'].str.slice(0, 8) + '...',
+        'Full User ID': df['user_id'],
+        'Username': df['user_info.username'].fillna('N/A'),
+        'Email': df['user_info.email'].fillna('N/A'),
+        'Name': df['user_info.name'].fillna('N/A'),
+        'Thread Count': df['thread_count'],
+        'Avg Messages': pd.to_numeric(df['avg_messages_per_thread'].fillna(0), downcast='integer'),
+        'Total Messages': df['total_messages'].fillna(0).astype('int64')
+    })
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_user_stats_df(report_key: str, _threads_per_user: dict) -> pd.DataFrame:
+    """Bảng user statistics dựng vectorized từ threads_per_user, sort theo Threads (cache theo report_key)"""
+    df = build_users_frame(_threads_per_user).reindex(columns=[
+        'user_id', 'user_info.username', 'user_info.email', 'thread_count', 'total_messages',
+        'avg_messages_per_thread', 'first_thread_time', 'last_thread_time', 'user_lifetime_human'
+    ])
+    df_stats = pd.DataFrame({
+        'User ID': df['user_id'].str.slice(0, 8) + '...',
+        'Full User ID': df['user_id'],
+        'Username': df['user_info.username'].fillna('N/A'),
+        'Email': df['user_info.email'].fillna('N/A'),
+        'Threads': df['thread_count'].fillna(0).astype('int64'),
+        'Total Messages': df['total_messages'].fillna(0).astype('int64'),
+        'Avg Msg/Thread': df['avg_messages_per_thread'].fillna(0),
+        'First Thread': df['first_thread_time'].fillna('N/A').str.slice(0, 10),
+        'Last Thread': df['last_thread_time'].fillna('N/A').str.slice(0, 10),
+        'User Lifetime': df['user_lifetime_human'].fillna('N/A')
+    })
+    return df_stats.sort_values('Threads', ascending=False, kind='mergesort')
+
+def _get_threads_with_tools(tool_calling_stats: Dict[str, Any]) -> dict:
+    """Threads có tool calls: dùng dict lọc sẵn từ analyzer, report cũ thì tự lọc"""
+    threads_with_tools = tool_calling_stats.get('threads_with_tools')
+    if threads_with_tools is not None:
+        return threads_with_tools
+    return {
+        thread_id: thread_info
+        for thread_id, thread_info in tool_calling_stats.get('tool_calls_by_thread', {}).items()
+        if thread_info.get('tool_stats', {}).get('total_tool_calls', 0) > 0
+    }
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_threads_df(stats_key: str, _threads_with_tools: dict) -> pd.DataFrame:
+    """DataFrame threads có tool calls, sắp xếp giảm dần theo Total Calls (cache theo stats_key)"""
+    # Walrus giữ lại tool_stats để không phải .get lại cho mỗi cột
+    thread_data = [
+        {
+            'Thread ID': thread_id,
+            'User ID': thread_info.get('thread_metadata', {}).get('user_id', ''),
+            'Created': thread_info.get('created_at', '')[:10],
+            'Create Lead': (tool_stats := thread_info.get('tool_stats', {})).get('create_lead', 0),
+            'Send HTML Email': tool_stats.get('send_html_email', 0),
+            'Total Calls': tool_stats.get('total_tool_calls', 0)
+        }
+        for thread_id, thread_info in _threads_with_tools.items()
+    ]
+    
+    if not thread_data:
+        return pd.DataFrame()
+    # Cột string (thread_id, user_id) chuyển sang PyArrow: nhẹ hơn object dtype, .str.* chạy trên buffer Arrow
+    df = pd.DataFrame(thread_data).convert_dtypes(dtype_backend='pyarrow')
+    return df.sort_values('Total Calls', ascending=False)
+
+def _filter_detailed_calls(detailed_calls: List[dict]) -> List[dict]:
+    """Chỉ giữ các call create_lead và send_html_email"""
+    return [
+        call for call in detailed_calls 
+        if call.get('function_name') in ['create_lead', 'send_html_email']
+    ]
+
+def _build_detailed_df(detailed_calls: List[dict]) -> pd.DataFrame:
+    """DataFrame chi tiết tool calls đã format để hiển thị"""
+    filtered_calls = _filter_detailed_calls(detailed_calls)
+    if not filtered_calls:
+        return pd.DataFrame()
     
-    col1, col2, col3, col4 = st.columns(4)
+    df_detailed = pd.DataFrame(filtered_calls)
     
-    with col1:
-        st.metric(
-            label="📊 Tổng Threads",
-            value=summary.get('total_threads', 0),
-            help="Tổng số threads trong khoảng thời gian"
-        )
+    # Rearrange columns với thêm arguments
+    columns_order = ['timestamp', 'thread_id', 'function_name', 'arguments', 'call_id', 'message_type']
+    df_detailed = df_detailed[columns_order]
     
-    with col2:
-        st.metric(
-            label="👥 Tổng Users",
-            value=summary.get('total_users', 0),
-            help="Số lượng users duy nhất"
-        )
+    # Format timestamp - parse ISO8601 một lần, cắt chuỗi 'YYYY-MM-DD HH:MM' thay cho strftime từng phần tử
+    timestamps = pd.to_datetime(df_detailed['timestamp'], format='ISO8601', cache=True)
+    df_detailed['timestamp'] = timestamps.astype(str).str.slice(0, 16).where(timestamps.notna())
+    
+    # Format arguments - truncate nếu quá dài (vectorized thay cho apply từng dòng)
+    arguments = df_detailed['arguments'].map(str)
+    arguments_head = arguments.str.slice(0, 100)
+    df_detailed['arguments'] = arguments_head.where(arguments.str.len() <= 100, arguments_head + '...')
     
-    with col3:
-        st.metric(
-            label="💬 TB Threads/User",
-            value=summary.get('avg_threads_per_user', 0),
-            help="Trung bình số threads trên mỗi user"
+    # Rename columns
+    df_detailed.columns = ['Timestamp', 'Thread ID', 'Function', 'Arguments', 'Call ID', 'Message Type']
+    
+    # Show most recent first
+    return df_detailed.convert_dtypes(dtype_backend='pyarrow').sort_values('Timestamp', ascending=False)
+
+@st.cache_resource(show_spinner=False, max_entries=8, ttl=600)
+def _build_detailed_table(stats_key: str, _detailed_calls: List[dict]) -> pa.Table:
+    """Arrow Table chi tiết tool calls (cache theo stats_key)
+    
+    Table bất biến nên dùng chung qua cache_resource, st.dataframe nhận thẳng Arrow
+    mà không phải chuyển pandas -> Arrow mỗi lần rerun.
+    """
+    return pa.Table.from_pandas(_build_detailed_df(_detailed_calls), preserve_index=False)
+
+def _display_detailed_table(detailed_table: pa.Table, key: str):
+    """Hiển thị bảng detailed tool calls theo trang, chỉ gửi một cửa sổ dòng xuống browser"""
+    n_pages = math.ceil(detailed_table.num_rows / DETAILED_PAGE_SIZE)
+    page = 1
+    if n_pages > 1:
+        page = st.number_input(
+            f"Trang (1-{n_pages}, {DETAILED_PAGE_SIZE} dòng/trang)",
+            min_value=1,
+            max_value=n_pages,
+            value=1,
+            key=key
         )
     
-    with col4:
-        analysis_date = summary.get('analysis_date', '')
-        if analysis_date:
-            formatted_date = analysis_date.split('T')[0]
-            st.metric(
-                label="📅 Ngày Phân Tích",
-                value=formatted_date,
-                help="Ngày thực hiện phân tích"
-            )
+    start = (page - 1) * DETAILED_PAGE_SIZE
+    st.dataframe(
+        detailed_table.slice(start, DETAILED_PAGE_SIZE),
+        use_container_width=True,
+        hide_index=True,
+        column_config={
+            'Arguments': st.column_config.TextColumn("Arguments", width="large")
+        }
+    )
+
+def _display_call_arguments(filtered_calls: List[dict]):
+    """Chọn một tool call và xem full arguments"""
+    # Dựng label một lần; fragment rerun dùng lại đúng list này nên không format lại
+    labels = [f"{call['function_name']} - {call['call_id'][:8]}..." for call in filtered_calls]
+    _call_arguments_fragment(filtered_calls, labels)
+
+@st.fragment
+def _call_arguments_fragment(filtered_calls: List[dict], labels: List[str]):
+    """Fragment: đổi lựa chọn chỉ rerun phần này"""
+    selected_call = st.selectbox(
+        "Select a tool call to view full arguments:",
+        options=range(len(labels)),
+        format_func=labels.__getitem__
+    )
+    
+    if selected_call < len(filtered_calls):
+        call_detail = filtered_calls[selected_call]
+        st.json({
+            "Function": call_detail['function_name'],
+            "Call ID": call_detail['call_id'],
+            "Thread ID": call_detail['thread_id'],
+            "Timestamp": call_detail['timestamp'],
+            "Arguments": call_detail['arguments']
+        })
+
+def _materialize_tool_frames(tool_calling_stats: Dict[str, Any], report_data: Optional[Dict[str, Any]] = None) -> Tuple[pd.DataFrame, pd.DataFrame, pa.Table]:
+    """Dựng một lần 3 bảng tool calling (theo ngày, theo thread, chi tiết dạng Arrow) dùng chung cho các renderer"""
+    stats_key = tool_stats_cache_key(tool_calling_stats, report_data)
+    return (
+        _build_timeline_df(stats_key, tool_calling_stats.get('tool_calls_by_date', {})),
+        _build_threads_df(stats_key, _get_threads_with_tools(tool_calling_stats)),
+        _build_detailed_table(stats_key, tool_calling_stats.get('detailed_calls', []))
+    )
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _build_tool_pie_figure(create_lead: int, send_html_email: int) -> go.Figure:
+    """Dựng pie chart phân bố tool calls"""
+    df_tools = _build_tools_df(create_lead, send_html_email)
+    fig_pie = px.pie(
+        df_tools, 
+        values='Count', 
+        names='Tool',
+        color='Tool',
+        color_discrete_map={
+            'Create Lead': '#FF6B6B',
+            'Send HTML Email': '#4ECDC4'
+        },
+        title="Distribution of Tool Calls"
+    )
+    fig_pie.update_traces(textposition='inside', textinfo='percent+label')
+    return fig_pie
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _build_tool_timeline_figure(stats_key: str, _tool_calls_by_date: dict) -> go.Figure:
+    """Dựng timeline tool calls theo ngày (cache theo stats_key)"""
+    df_timeline = _build_timeline_df(stats_key, _tool_calls_by_date)
+    df_timeline['Date'] = pd.to_datetime(df_timeline['Date'])
+    # _build_timeline_df đã xếp mới nhất trước, đảo lại là tăng dần theo ngày
+    df_timeline = df_timeline.iloc[::-1]
+    
+    # Line chart wide-form: cả 2 trace dựng trong một lần gọi px.line
+    fig_timeline = px.line(
+        df_timeline,
+        x='Date',
+        y=['Create Lead', 'Send HTML Email'],
+        markers=True,
+        color_discrete_map={
+            'Create Lead': '#FF6B6B',
+            'Send HTML Email': '#4ECDC4'
+        },
+        render_mode='webgl' if len(df_timeline) > WEBGL_POINT_THRESHOLD else 'svg',
+        title="Tool Calls Timeline"
+    )
+    fig_timeline.update_traces(line_width=3, marker_size=8, hovertemplate=None)
+    
+    fig_timeline.update_layout(
+        xaxis_title="Date",
+        yaxis_title="Number of Calls",
+        legend_title_text='',
+        hovermode='x unified',
+        showlegend=True
+    )
+    return fig_timeline
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def _build_top_threads_figure(stats_key: str, _threads_with_tools: dict) -> Optional[go.Figure]:
+    """Dựng bar chart top 20 threads theo tool usage (cache theo stats_key), None nếu không có thread nào dùng tools"""
+    # df_threads chỉ gồm threads có tool calls
+    df_threads = _build_threads_df(stats_key, _threads_with_tools)
+    if df_threads.empty:
+        return None
+    
+    df_threads = df_threads.nlargest(20, 'Total Calls')  # Top 20
+    # Truyền ndarray để plotly serialize qua buffer thay vì duyệt từng ô của Series
+    thread_ids = (df_threads['Thread ID'].str[:8] + '...').to_numpy()  # Rút gọn thread ID
+    create_lead = df_threads['Create Lead'].to_numpy(dtype=np.int32)
+    send_html_email = df_threads['Send HTML Email'].to_numpy(dtype=np.int32)
+    
+    fig_bar = go.Figure()
+    
+    fig_bar.add_trace(go.Bar(
+        name='Create Lead',
+        x=thread_ids,
+        y=create_lead,
+        marker_color='#FF6B6B'
+    ))
+    
+    fig_bar.add_trace(go.Bar(
+        name='Send HTML Email',
+        x=thread_ids,
+        y=send_html_email,
+        marker_color='#4ECDC4'
+    ))
+    
+    fig_bar.update_layout(
+        title="Top 20 Threads by Tool Usage",
+        xaxis_title="Thread ID",
+        yaxis_title="Number of Tool Calls",
+        barmode='stack',
+        xaxis={'categoryorder': 'total descending'},
+        uirevision='bar'
+    )
+    return fig_bar
+
+def _render_metric_row(specs: List[Optional[Tuple[str, Any, str]]]):
+    """Render một hàng metrics từ list (label, value, help); None giữ chỗ cột trống"""
+    cols = st.columns(len(specs))
+    for col, spec in zip(cols, specs):
+        if spec is not None:
+            label, value, help_text = spec
+            col.metric(label=label, value=value, help=help_text)
+
+def _get_combined_tool_figures(report_data: Dict[str, Any], tool_calling_stats: Dict[str, Any]) -> Dict[str, Optional[go.Figure]]:
+    """Figures tab Tool Calling của combined view, giữ trong session_state theo render key
+    
+    Rerun với cùng report (đổi tab, bấm widget khác) dùng lại figure đã dựng,
+    không phải lấy bản copy từ cache_data mỗi lần.
+    """
+    # stats_key đã gồm report_cache_key nên dùng luôn làm render key
+    render_key = stats_key = tool_stats_cache_key(tool_calling_stats, report_data)
+    if st.session_state.get('combined_render_key') == render_key and 'combined_figs' in st.session_state:
+        return st.session_state['combined_figs']
+    
+    create_lead = tool_calling_stats.get('create_lead', 0)
+    send_html_email = tool_calling_stats.get('send_html_email', 0)
+    tool_calls_by_date = tool_calling_stats.get('tool_calls_by_date', {})
+    has_calls = create_lead > 0 or send_html_email > 0
+    figs = {
+        'pie': _build_tool_pie_figure(create_lead, send_html_email) if has_calls else None,
+        'timeline': _build_tool_timeline_figure(stats_key, tool_calls_by_date) if has_calls and tool_calls_by_date else None
+    }
+    st.session_state['combined_render_key'] = render_key
+    st.session_state['combined_figs'] = figs
+    return figs
+
+def display_overview_metrics(report: Dict[str, Any]):
+    """Hiển thị metrics tổng quan"""
+    summary = report.get('summary', {})
+    analysis_date = summary.get('analysis_date', '')
+    
+    _render_metric_row([
+        ("📊 Tổng Threads", summary.get('total_threads', 0), "Tổng số threads trong khoảng thời gian"),
+        ("👥 Tổng Users", summary.get('total_users', 0), "Số lượng users duy nhất"),
+        ("💬 TB Threads/User", summary.get('avg_threads_per_user', 0), "Trung bình số threads trên mỗi user"),
+        ("📅 Ngày Phân Tích", analysis_date.split('T')[0], "Ngày thực hiện phân tích") if analysis_date else None
+    ])
 
 
 def display_tool_calling_metrics(tool_calling_stats: Dict[str, Any]):
@@ -52,60 +363,25 @@ def display_tool_calling_metrics(tool_calling_stats: Dict[str, Any]):
     st.subheader("🔧 Tool Calling Statistics")
     
     # Metrics hàng 1
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.metric(
-            label="🎯 Create Lead",
-            value=tool_calling_stats.get('create_lead', 0),
-            help="Tổng số lần gọi create_lead"
-        )
-    
-    with col2:
-        st.metric(
-            label="📧 Send Email",
-            value=tool_calling_stats.get('send_email', 0),
-            help="Tổng số lần gọi send_email/send_html_email"
-        )
-    
-    with col3:
-        st.metric(
-            label="🔧 Total Tool Calls",
-            value=tool_calling_stats.get('total_tool_calls', 0),
-            help="Tổng số lần gọi tất cả tools"
-        )
-    
-    with col4:
-        threads_with_tools = tool_calling_stats.get('threads_with_any_tool', 0)
-        st.metric(
-            label="📈 Threads with Tools",
-            value=threads_with_tools,
-            help="Số threads có sử dụng tools"
-        )
+    _render_metric_row([
+        ("🎯 Create Lead", tool_calling_stats.get('create_lead', 0), "Tổng số lần gọi create_lead"),
+        ("📧 Send Email", tool_calling_stats.get('send_email', 0), "Tổng số lần gọi send_email/send_html_email"),
+        ("🔧 Total Tool Calls", tool_calling_stats.get('total_tool_calls', 0), "Tổng số lần gọi tất cả tools"),
+        ("📈 Threads with Tools", tool_calling_stats.get('threads_with_any_tool', 0), "Số threads có sử dụng tools")
+    ])
     
     # Metrics hàng 2
-    col5, col6 = st.columns(2)
-    
-    with col5:
-        threads_create_lead = tool_calling_stats.get('threads_with_create_lead', 0)
-        st.metric(
-            label="🎯 Threads w/ Create Lead",
-            value=threads_create_lead,
-            help="Số threads có gọi create_lead"
-        )
-    
-    with col6:
-        threads_send_html_email = tool_calling_stats.get('threads_with_send_html_email', 0)
-        st.metric(
-            label="📧 Threads w/ Send HTML Email",
-            value=threads_send_html_email,
-            help="Số threads có gọi send_html_email"
-        )
+    _render_metric_row([
+        ("🎯 Threads w/ Create Lead", tool_calling_stats.get('threads_with_create_lead', 0), "Số threads có gọi create_lead"),
+        ("📧 Threads w/ Send HTML Email", tool_calling_stats.get('threads_with_send_html_email', 0), "Số threads có gọi send_html_email")
+    ])
 
 
 def create_tool_calling_charts(tool_calling_stats: Dict[str, Any]):
     """Tạo charts cho tool calling statistics"""
     
+    stats_key = tool_stats_cache_key(tool_calling_stats)
+    
     # 1. Pie chart cho distribution of tool calls
     st.subheader("🥧 Tool Call Distribution")
     
@@ -113,28 +389,7 @@ def create_tool_calling_charts(tool_calling_stats: Dict[str, Any]):
     send_html_email = tool_calling_stats.get('send_html_email', 0)
     
     if create_lead > 0 or send_html_email > 0:
-        tool_data = []
-        if create_lead > 0:
-            tool_data.append({'Tool': 'Create Lead', 'Count': create_lead, 'Color': '#FF6B6B'})
-        if send_html_email > 0:
-            tool_data.append({'Tool': 'Send HTML Email', 'Count': send_html_email, 'Color': '#4ECDC4'})
-        
-        if tool_data:
-            df_tools = pd.DataFrame(tool_data)
-            
-            fig_pie = px.pie(
-                df_tools, 
-                values='Count', 
-                names='Tool',
-                color='Tool',
-                color_discrete_map={
-                    'Create Lead': '#FF6B6B',
-                    'Send HTML Email': '#4ECDC4'
-                },
-                title="Distribution of Tool Calls"
-            )
-            fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-            st.plotly_chart(fig_pie, use_container_width=True)
+        st.plotly_chart(_build_tool_pie_figure(create_lead, send_html_email), use_container_width=True)
     else:
         st.info("Không có dữ liệu tool calling để hiển thị")
     
@@ -142,106 +397,15 @@ def create_tool_calling_charts(tool_calling_stats: Dict[str, Any]):
     tool_calls_by_date = tool_calling_stats.get('tool_calls_by_date', {})
     if tool_calls_by_date:
         st.subheader("📈 Tool Calls Over Time")
-        
-        date_data = []
-        for date_str, stats in tool_calls_by_date.items():
-            date_data.append({
-                'Date': date_str,
-                'Create Lead': stats.get('create_lead', 0),
-                'Send HTML Email': stats.get('send_html_email', 0),
-                'Total': stats.get('total', 0)
-            })
-        
-        df_timeline = pd.DataFrame(date_data)
-        df_timeline['Date'] = pd.to_datetime(df_timeline['Date'])
-        df_timeline = df_timeline.sort_values('Date')
-        
-        # Line chart với multiple lines
-        fig_timeline = go.Figure()
-        
-        fig_timeline.add_trace(go.Scatter(
-            x=df_timeline['Date'],
-            y=df_timeline['Create Lead'],
-            mode='lines+markers',
-            name='Create Lead',
-            line=dict(color='#FF6B6B', width=3),
-            marker=dict(size=8)
-        ))
-        
-        fig_timeline.add_trace(go.Scatter(
-            x=df_timeline['Date'],
-            y=df_timeline['Send HTML Email'],
-            mode='lines+markers',
-            name='Send HTML Email',
-            line=dict(color='#4ECDC4', width=3),
-            marker=dict(size=8)
-        ))
-        
-
-        
-        fig_timeline.update_layout(
-            title="Tool Calls Timeline",
-            xaxis_title="Date",
-            yaxis_title="Number of Calls",
-            hovermode='x unified',
-            showlegend=True
-        )
-        
-        st.plotly_chart(fig_timeline, use_container_width=True)
+        st.plotly_chart(_build_tool_timeline_figure(stats_key, tool_calls_by_date), use_container_width=True)
     
     # 3. Bar chart cho top threads by tool usage
     tool_calls_by_thread = tool_calling_stats.get('tool_calls_by_thread', {})
     if tool_calls_by_thread:
         st.subheader("🏆 Top Threads by Tool Usage")
         
-        thread_data = []
-        for thread_id, thread_info in tool_calls_by_thread.items():
-            tool_stats = thread_info.get('tool_stats', {})
-            total_calls = tool_stats.get('total_tool_calls', 0)
-            
-            if total_calls > 0:  # Chỉ hiển thị threads có tool calls
-                metadata = thread_info.get('thread_metadata', {})
-                user_id = metadata.get('user_id', 'Unknown')
-                
-                thread_data.append({
-                    'Thread ID': thread_id[:8] + '...',  # Rút gọn thread ID
-                    'Full Thread ID': thread_id,
-                    'User ID': user_id,
-                    'Create Lead': tool_stats.get('create_lead', 0),
-                    'Send HTML Email': tool_stats.get('send_html_email', 0),
-                    'Total Calls': total_calls
-                })
-        
-        if thread_data:
-            df_threads = pd.DataFrame(thread_data)
-            df_threads = df_threads.sort_values('Total Calls', ascending=False).head(20)  # Top 20
-            
-            fig_bar = go.Figure()
-            
-            fig_bar.add_trace(go.Bar(
-                name='Create Lead',
-                x=df_threads['Thread ID'],
-                y=df_threads['Create Lead'],
-                marker_color='#FF6B6B'
-            ))
-            
-            fig_bar.add_trace(go.Bar(
-                name='Send HTML Email',
-                x=df_threads['Thread ID'],
-                y=df_threads['Send HTML Email'],
-                marker_color='#4ECDC4'
-            ))
-            
-
-            
-            fig_bar.update_layout(
-                title="Top 20 Threads by Tool Usage",
-                xaxis_title="Thread ID",
-                yaxis_title="Number of Tool Calls",
-                barmode='stack',
-                xaxis={'categoryorder': 'total descending'}
-            )
-            
+        fig_bar = _build_top_threads_figure(stats_key, _get_threads_with_tools(tool_calling_stats))
+        if fig_bar is not None:
             st.plotly_chart(fig_bar, use_container_width=True)
 
 
@@ -250,6 +414,8 @@ def display_tool_calling_tables(tool_calling_stats: Dict[str, Any]):
     
     st.subheader("📊 Data Tables")
     
+    df_dates, df_threads, detailed_table = _materialize_tool_frames(tool_calling_stats)
+    
     # Tạo tabs cho các tables khác nhau
     tab1, tab2, tab3 = st.tabs(["📅 Tool Calls by Date", "🏆 Top Threads", "🔍 Detailed Tool Calls"])
     
@@ -257,17 +423,6 @@ def display_tool_calling_tables(tool_calling_stats: Dict[str, Any]):
     with tab1:
         tool_calls_by_date = tool_calling_stats.get('tool_calls_by_date', {})
         if tool_calls_by_date:
-            date_data = []
-            for date_str, stats in tool_calls_by_date.items():
-                date_data.append({
-                    'Date': date_str,
-                    'Create Lead': stats.get('create_lead', 0),
-                    'Send HTML Email': stats.get('send_html_email', 0),
-                    'Total': stats.get('total', 0)
-                })
-            
-            df_dates = pd.DataFrame(date_data)
-            df_dates = df_dates.sort_values('Date', ascending=False)
             st.dataframe(df_dates, use_container_width=True)
         else:
             st.info("Không có dữ liệu tool calls by date")
@@ -276,26 +431,7 @@ def display_tool_calling_tables(tool_calling_stats: Dict[str, Any]):
     with tab2:
         tool_calls_by_thread = tool_calling_stats.get('tool_calls_by_thread', {})
         if tool_calls_by_thread:
-            thread_data = []
-            for thread_id, thread_info in tool_calls_by_thread.items():
-                tool_stats = thread_info.get('tool_stats', {})
-                total_calls = tool_stats.get('total_tool_calls', 0)
-                
-                if total_calls > 0:
-                    metadata = thread_info.get('thread_metadata', {})
-                    
-                    thread_data.append({
-                        'Thread ID': thread_id,
-                        'User ID': metadata.get('user_id', ''),
-                        'Created': thread_info.get('created_at', '')[:10],
-                        'Create Lead': tool_stats.get('create_lead', 0),
-                        'Send HTML Email': tool_stats.get('send_html_email', 0),
-                        'Total Calls': total_calls
-                    })
-            
-            if thread_data:
-                df_threads = pd.DataFrame(thread_data)
-                df_threads = df_threads.sort_values('Total Calls', ascending=False)
+            if not df_threads.empty:
                 st.dataframe(df_threads, use_container_width=True)
             else:
                 st.info("Không có threads nào sử dụng tools")
@@ -307,51 +443,14 @@ def display_tool_calling_tables(tool_calling_stats: Dict[str, Any]):
         detailed_calls = tool_calling_stats.get('detailed_calls', [])
         if detailed_calls:
             # Chỉ hiển thị create_lead và send_html_email calls
-            filtered_calls = [
-                call for call in detailed_calls 
-                if call.get('function_name') in ['create_lead', 'send_html_email']
-            ]
-            
-            if filtered_calls:
-                df_detailed = pd.DataFrame(filtered_calls)
-                
-                # Rearrange columns với thêm arguments
-                columns_order = ['timestamp', 'thread_id', 'function_name', 'arguments', 'call_id', 'message_type']
-                df_detailed = df_detailed[columns_order]
-                
-                # Format timestamp
-                df_detailed['timestamp'] = pd.to_datetime(df_detailed['timestamp']).dt.strftime('%Y-%m-%d %H:%M')
+            if detailed_table.num_rows:
+                filtered_calls = _filter_detailed_calls(detailed_calls)
                 
-                # Format arguments - truncate nếu quá dài
-                df_detailed['arguments'] = df_detailed['arguments'].apply(
-                    lambda x: str(x)[:100] + '...' if len(str(x)) > 100 else str(x)
-                )
-                
-                # Rename columns
-                df_detailed.columns = ['Timestamp', 'Thread ID', 'Function', 'Arguments', 'Call ID', 'Message Type']
-                
-                # Show most recent first
-                df_detailed = df_detailed.sort_values('Timestamp', ascending=False)
-                
-                st.dataframe(df_detailed, use_container_width=True)
+                _display_detailed_table(detailed_table, key="tool_detailed_calls_page")
                 
                 # Thêm expander để xem full arguments
                 with st.expander("🔍 View Full Arguments Details"):
-                    selected_call = st.selectbox(
-                        "Select a tool call to view full arguments:",
-                        options=range(len(filtered_calls)),
-                        format_func=lambda x: f"{filtered_calls[x]['function_name']} - {filtered_calls[x]['call_id'][:8]}..." if x < len(filtered_calls) else ""
-                    )
-                    
-                    if selected_call < len(filtered_calls):
-                        call_detail = filtered_calls[selected_call]
-                        st.json({
-                            "Function": call_detail['function_name'],
-                            "Call ID": call_detail['call_id'],
-                            "Thread ID": call_detail['thread_id'],
-                            "Timestamp": call_detail['timestamp'],
-                            "Arguments": call_detail['arguments']
-                        })
+                    _display_call_arguments(filtered_calls)
             else:
                 st.info("Không có tool calls để hiển thị")
         else:
@@ -368,148 +467,49 @@ def display_combined_metrics_and_charts(report_data: Dict[str, Any]):
     
     # Overview metrics
     summary = report_data.get('summary', {})
+    total_threads = summary.get('total_threads', 0)
     
-    # Row 1: General metrics
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        st.metric(
-            label="📊 Total Threads",
-            value=f"{summary.get('total_threads', 0):,}",
-            help="Tổng số threads được phân tích"
-        )
-    
-    with col2:
-        st.metric(
-            label="👥 Total Users",
-            value=f"{summary.get('total_users', 0):,}",
-            help="Tổng số users"
-        )
-    
-    with col3:
-        avg_threads = summary.get('avg_threads_per_user', '0')
-        st.metric(
-            label="📈 Avg Threads/User",
-            value=avg_threads,
-            help="Trung bình threads mỗi user"
-        )
+    threads_by_date = report_data.get('threads_by_date', {})
+    active_days = len(threads_by_date)
+    avg_threads_per_day = total_threads / active_days if active_days > 0 else 0
     
-    with col4:
-        total_messages = summary.get('total_messages', 0)
-        st.metric(
-            label="💬 Total Messages",
-            value=f"{total_messages:,}",
-            help="Tổng số messages trong tất cả threads"
-        )
+    # Row 1: General metrics
+    _render_metric_row([
+        ("📊 Total Threads", f"{total_threads:,}", "Tổng số threads được phân tích"),
+        ("👥 Total Users", f"{summary.get('total_users', 0):,}", "Tổng số users"),
+        ("📈 Avg Threads/User", summary.get('avg_threads_per_user', '0'), "Trung bình threads mỗi user"),
+        ("💬 Total Messages", f"{summary.get('total_messages', 0):,}", "Tổng số messages trong tất cả threads")
+    ])
     
     # Row 2: Message metrics
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        user_messages = summary.get('user_messages', 0)
-        st.metric(
-            label="👤 User Messages",
-            value=f"{user_messages:,}",
-            help="Tổng số messages của users"
-        )
-    
-    with col2:
-        ai_messages = summary.get('ai_messages', 0)
-        st.metric(
-            label="🤖 AI Messages", 
-            value=f"{ai_messages:,}",
-            help="Tổng số messages của AI"
-        )
-    
-    with col3:
-        avg_messages = summary.get('avg_messages_per_user', 0)
-        st.metric(
-            label="📈 Avg Messages/User",
-            value=f"{avg_messages:.1f}",
-            help="Trung bình messages mỗi user"
-        )
-    
-    with col4:
-        avg_msg_thread = summary.get('avg_messages_per_thread', 0)
-        st.metric(
-            label="📈 Avg Messages/Thread",
-            value=f"{avg_msg_thread:.1f}",
-            help="Trung bình messages mỗi thread"
-        )
+    _render_metric_row([
+        ("👤 User Messages", f"{summary.get('user_messages', 0):,}", "Tổng số messages của users"),
+        ("🤖 AI Messages", f"{summary.get('ai_messages', 0):,}", "Tổng số messages của AI"),
+        ("📈 Avg Messages/User", f"{summary.get('avg_messages_per_user', 0):.1f}", "Trung bình messages mỗi user"),
+        ("📈 Avg Messages/Thread", f"{summary.get('avg_messages_per_thread', 0):.1f}", "Trung bình messages mỗi thread")
+    ])
     
     # Row 3: Peak day statistics
-    col1, col2, col3, col4 = st.columns(4)
-    
-    with col1:
-        peak_day = summary.get('peak_day', 'N/A')
-        st.metric(
-            label="📅 Peak Day",
-            value=peak_day,
-            help="Ngày có nhiều threads nhất"
-        )
-    
-    with col2:
-        peak_threads = summary.get('peak_threads', 0)
-        st.metric(
-            label="📊 Peak Threads",
-            value=f"{peak_threads:,}",
-            help="Số threads trong ngày peak"
-        )
-    
-    with col3:
-        # Activity days
-        threads_by_date = report_data.get('threads_by_date', {})
-        active_days = len(threads_by_date)
-        st.metric(
-            label="📅 Active Days",
-            value=f"{active_days:,}",
-            help="Số ngày có hoạt động"
-        )
-    
-    with col4:
-        # Average threads per day
-        avg_threads_per_day = summary.get('total_threads', 0) / active_days if active_days > 0 else 0
-        st.metric(
-            label="📈 Avg Threads/Day",
-            value=f"{avg_threads_per_day:.1f}",
-            help="Trung bình threads mỗi ngày"
-        )
+    _render_metric_row([
+        ("📅 Peak Day", summary.get('peak_day', 'N/A'), "Ngày có nhiều threads nhất"),
+        ("📊 Peak Threads", f"{summary.get('peak_threads', 0):,}", "Số threads trong ngày peak"),
+        ("📅 Active Days", f"{active_days:,}", "Số ngày có hoạt động"),
+        ("📈 Avg Threads/Day", f"{avg_threads_per_day:.1f}", "Trung bình threads mỗi ngày")
+    ])
     
     # Row 4: Tool calling metrics (if available)
     tool_calling_stats = report_data.get('tool_calling_stats', {})
+    create_lead = tool_calling_stats.get('create_lead', 0)
+    send_html_email = tool_calling_stats.get('send_html_email', 0)
     if tool_calling_stats:
         st.markdown("#### 🔧 Tool Calling Statistics")
         
-        col1, col2, col3, col4 = st.columns(4)
-        
-        with col1:
-            st.metric(
-                label="🔧 Total Tool Calls",
-                value=f"{tool_calling_stats.get('total_tool_calls', 0):,}",
-                help="Tổng số lần gọi tất cả tools"
-            )
-        
-        with col2:
-            st.metric(
-                label="🎯 Create Lead Calls",
-                value=f"{tool_calling_stats.get('create_lead', 0):,}",
-                help="Số lần gọi create_lead"
-            )
-        
-        with col3:
-            st.metric(
-                label="📧 Send HTML Email Calls",
-                value=f"{tool_calling_stats.get('send_html_email', 0):,}",
-                help="Số lần gọi send_html_email"
-            )
-        
-        with col4:
-            threads_with_tools = tool_calling_stats.get('threads_with_any_tool', 0)
-            st.metric(
-                label="📈 Threads with Tools",
-                value=threads_with_tools,
-                help="Số threads có sử dụng tools"
-            )
+        _render_metric_row([
+            ("🔧 Total Tool Calls", f"{tool_calling_stats.get('total_tool_calls', 0):,}", "Tổng số lần gọi tất cả tools"),
+            ("🎯 Create Lead Calls", f"{create_lead:,}", "Số lần gọi create_lead"),
+            ("📧 Send HTML Email Calls", f"{send_html_email:,}", "Số lần gọi send_html_email"),
+            ("📈 Threads with Tools", tool_calling_stats.get('threads_with_any_tool', 0), "Số threads có sử dụng tools")
+        ])
     
     # === CHARTS SECTION ===
     st.markdown("---")
@@ -523,22 +523,10 @@ def display_combined_metrics_and_charts(report_data: Dict[str, Any]):
         col1, col2 = st.columns(2)
         
         with col1:
-            # Import charts từ components.charts
-            from components.charts import (
-                create_threads_timeline_chart,
-                create_messages_timeline_chart,
-                create_user_distribution_chart
-            )
-            
             create_threads_timeline_chart(report_data)
             create_user_distribution_chart(report_data)
         
         with col2:
-            from components.charts import (
-                create_top_thread_users_chart,
-                create_top_message_users_chart
-            )
-            
             create_top_thread_users_chart(report_data)
             create_top_message_users_chart(report_data)
     
@@ -547,83 +535,18 @@ def display_combined_metrics_and_charts(report_data: Dict[str, Any]):
         if tool_calling_stats:
             # Tool calling pie chart
             st.markdown("##### 🥧 Tool Call Distribution")
-            create_lead = tool_calling_stats.get('create_lead', 0)
-            send_html_email = tool_calling_stats.get('send_html_email', 0)
             
-            if create_lead > 0 or send_html_email > 0:
-                tool_data = []
-                if create_lead > 0:
-                    tool_data.append({'Tool': 'Create Lead', 'Count': create_lead, 'Color': '#FF6B6B'})
-                if send_html_email > 0:
-                    tool_data.append({'Tool': 'Send HTML Email', 'Count': send_html_email, 'Color': '#4ECDC4'})
+            figs = _get_combined_tool_figures(report_data, tool_calling_stats)
+            if figs['pie'] is not None:
+                col1, col2 = st.columns(2)
                 
-                if tool_data:
-                    df_tools = pd.DataFrame(tool_data)
-                    
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        fig_pie = px.pie(
-                            df_tools, 
-                            values='Count', 
-                            names='Tool',
-                            color='Tool',
-                            color_discrete_map={
-                                'Create Lead': '#FF6B6B',
-                                'Send HTML Email': '#4ECDC4'
-                            },
-                            title="Distribution of Tool Calls"
-                        )
-                        fig_pie.update_traces(textposition='inside', textinfo='percent+label')
-                        st.plotly_chart(fig_pie, use_container_width=True)
-                    
-                    with col2:
-                        # Tool calls timeline if available
-                        tool_calls_by_date = tool_calling_stats.get('tool_calls_by_date', {})
-                        if tool_calls_by_date:
-                            date_data = []
-                            for date_str, stats in tool_calls_by_date.items():
-                                date_data.append({
-                                    'Date': date_str,
-                                    'Create Lead': stats.get('create_lead', 0),
-                                    'Send HTML Email': stats.get('send_html_email', 0),
-                                    'Total': stats.get('total', 0)
-                                })
-                            
-                            df_timeline = pd.DataFrame(date_data)
-                            df_timeline['Date'] = pd.to_datetime(df_timeline['Date'])
-                            df_timeline = df_timeline.sort_values('Date')
-                            
-                            # Line chart
-                            fig_timeline = go.Figure()
-                            
-                            fig_timeline.add_trace(go.Scatter(
-                                x=df_timeline['Date'],
-                                y=df_timeline['Create Lead'],
-                                mode='lines+markers',
-                                name='Create Lead',
-                                line=dict(color='#FF6B6B', width=3),
-                                marker=dict(size=8)
-                            ))
-                            
-                            fig_timeline.add_trace(go.Scatter(
-                                x=df_timeline['Date'],
-                                y=df_timeline['Send HTML Email'],
-                                mode='lines+markers',
-                                name='Send HTML Email',
-                                line=dict(color='#4ECDC4', width=3),
-                                marker=dict(size=8)
-                            ))
-                            
-                            fig_timeline.update_layout(
-                                title="Tool Calls Timeline",
-                                xaxis_title="Date",
-                                yaxis_title="Number of Calls",
-                                hovermode='x unified',
-                                showlegend=True
-                            )
-                            
-                            st.plotly_chart(fig_timeline, use_container_width=True)
+                with col1:
+                    st.plotly_chart(figs['pie'], use_container_width=True)
+                
+                with col2:
+                    # Tool calls timeline if available
+                    if figs['timeline'] is not None:
+                        st.plotly_chart(figs['timeline'], use_container_width=True)
             else:
                 st.info("Không có dữ liệu tool calling để hiển thị")
         else:
@@ -634,24 +557,22 @@ def display_combined_metrics_and_charts(report_data: Dict[str, Any]):
         col1, col2 = st.columns(2)
         
         with col1:
-            from components.charts import (
-                create_user_message_distribution_chart,
-                create_user_message_chart
-            )
-            
             create_user_message_distribution_chart(report_data)
         
         with col2:
             create_user_message_chart(report_data) 
 
 
+@st.fragment
 def display_combined_data_tables(report_data: Dict[str, Any]):
-    """Hiển thị tất cả data tables gộp chung"""
+    """Hiển thị tất cả data tables gộp chung (fragment: widget trong các tab chỉ rerun phần này)"""
     
     st.subheader("📊 Data Tables")
     
     # Get tool calling stats
     tool_calling_stats = report_data.get('tool_calling_stats', {})
+    if tool_calling_stats:
+        df_tool_dates, df_threads, detailed_table = _materialize_tool_frames(tool_calling_stats, report_data)
     
     # Create tabs for all data tables
     if tool_calling_stats:
@@ -669,44 +590,14 @@ def display_combined_data_tables(report_data: Dict[str, Any]):
         with tab1:
             tool_calls_by_date = tool_calling_stats.get('tool_calls_by_date', {})
             if tool_calls_by_date:
-                date_data = []
-                for date_str, stats in tool_calls_by_date.items():
-                    date_data.append({
-                        'Date': date_str,
-                        'Create Lead': stats.get('create_lead', 0),
-                        'Send HTML Email': stats.get('send_html_email', 0),
-                        'Total': stats.get('total', 0)
-                    })
-                
-                df_dates = pd.DataFrame(date_data)
-                df_dates = df_dates.sort_values('Date', ascending=False)
-                st.dataframe(df_dates, use_container_width=True)
+                st.dataframe(df_tool_dates, use_container_width=True)
             else:
                 st.info("Không có dữ liệu tool calls by date")
         
         with tab2:
             tool_calls_by_thread = tool_calling_stats.get('tool_calls_by_thread', {})
             if tool_calls_by_thread:
-                thread_data = []
-                for thread_id, thread_info in tool_calls_by_thread.items():
-                    tool_stats = thread_info.get('tool_stats', {})
-                    total_calls = tool_stats.get('total_tool_calls', 0)
-                    
-                    if total_calls > 0:
-                        metadata = thread_info.get('thread_metadata', {})
-                        
-                        thread_data.append({
-                            'Thread ID': thread_id,
-                            'User ID': metadata.get('user_id', ''),
-                            'Created': thread_info.get('created_at', '')[:10],
-                            'Create Lead': tool_stats.get('create_lead', 0),
-                            'Send HTML Email': tool_stats.get('send_html_email', 0),
-                            'Total Calls': total_calls
-                        })
-            
-                if thread_data:
-                    df_threads = pd.DataFrame(thread_data)
-                    df_threads = df_threads.sort_values('Total Calls', ascending=False)
+                if not df_threads.empty:
                     st.dataframe(df_threads, use_container_width=True)
                 else:
                     st.info("Không có threads nào sử dụng tools")
@@ -717,51 +608,14 @@ def display_combined_data_tables(report_data: Dict[str, Any]):
             detailed_calls = tool_calling_stats.get('detailed_calls', [])
             if detailed_calls:
                 # Chỉ hiển thị create_lead và send_html_email calls
-                filtered_calls = [
-                    call for call in detailed_calls 
-                    if call.get('function_name') in ['create_lead', 'send_html_email']
-                ]
-                
-                if filtered_calls:
-                    df_detailed = pd.DataFrame(filtered_calls)
-                    
-                    # Rearrange columns với thêm arguments
-                    columns_order = ['timestamp', 'thread_id', 'function_name', 'arguments', 'call_id', 'message_type']
-                    df_detailed = df_detailed[columns_order]
+                if detailed_table.num_rows:
+                    filtered_calls = _filter_detailed_calls(detailed_calls)
                     
-                    # Format timestamp
-                    df_detailed['timestamp'] = pd.to_datetime(df_detailed['timestamp']).dt.strftime('%Y-%m-%d %H:%M')
-                    
-                    # Format arguments - truncate nếu quá dài
-                    df_detailed['arguments'] = df_detailed['arguments'].apply(
-                        lambda x: str(x)[:100] + '...' if len(str(x)) > 100 else str(x)
-                    )
-                    
-                    # Rename columns
-                    df_detailed.columns = ['Timestamp', 'Thread ID', 'Function', 'Arguments', 'Call ID', 'Message Type']
-                    
-                    # Show most recent first
-                    df_detailed = df_detailed.sort_values('Timestamp', ascending=False)
-                    
-                    st.dataframe(df_detailed, use_container_width=True)
+                    _display_detailed_table(detailed_table, key="combined_detailed_calls_page")
                     
                     # Thêm expander để xem full arguments
                     with st.expander("🔍 View Full Arguments Details"):
-                        selected_call = st.selectbox(
-                            "Select a tool call to view full arguments:",
-                            options=range(len(filtered_calls)),
-                            format_func=lambda x: f"{filtered_calls[x]['function_name']} - {filtered_calls[x]['call_id'][:8]}..." if x < len(filtered_calls) else ""
-                        )
-                        
-                        if selected_call < len(filtered_calls):
-                            call_detail = filtered_calls[selected_call]
-                            st.json({
-                                "Function": call_detail['function_name'],
-                                "Call ID": call_detail['call_id'],
-                                "Thread ID": call_detail['thread_id'],
-                                "Timestamp": call_detail['timestamp'],
-                                "Arguments": call_detail['arguments']
-                            })
+                        _display_call_arguments(filtered_calls)
                 else:
                     st.info("Không có tool calls để hiển thị")
             else:
@@ -775,12 +629,7 @@ def display_combined_data_tables(report_data: Dict[str, Any]):
         # Threads by date table
         threads_by_date = report_data.get('threads_by_date', {})
         if threads_by_date:
-            date_data = []
-            for date, count in threads_by_date.items():
-                date_data.append({'Date': date, 'Threads': count})
-            
-            df_dates = pd.DataFrame(date_data)
-            df_dates = df_dates.sort_values('Date', ascending=False)
+            df_dates = _build_threads_by_date_df(report_cache_key(report_data), threads_by_date)
             st.dataframe(df_dates, use_container_width=True)
         else:
             st.info("Không có dữ liệu threads by date")
@@ -789,21 +638,7 @@ def display_combined_data_tables(report_data: Dict[str, Any]):
         # Top users table
         top_users = report_data.get('top_users', [])
         if top_users:
-            users_data = []
-            for user in top_users:
-                user_info = user.get('user_info', {})
-                users_data.append({
-                    'User ID': user['user_id'][:8] + '...',
-                    'Full User ID': user['user_id'],
-                    'Username': user_info.get('username', 'N/A'),
-                    'Email': user_info.get('email', 'N/A'),
-                    'Name': user_info.get('name', 'N/A'),
-                    'Thread Count': user['thread_count'],
-                    'Avg Messages': user.get('avg_messages_per_thread', 0),
-                    'Total Messages': user.get('total_messages', 0)
-                })
-            
-            df_users = pd.DataFrame(users_data)
+            df_users = _build_top_users_df(report_cache_key(report_data), top_users)
             st.dataframe(df_users, use_container_width=True)
         else:
             st.info("Không có dữ liệu top users")
@@ -812,26 +647,7 @@ def display_combined_data_tables(report_data: Dict[str, Any]):
         # User statistics table
         user_stats = report_data.get('user_stats', {})
         if user_stats and 'threads_per_user' in user_stats:
-            stats_data = []
-            threads_per_user = user_stats['threads_per_user']
-            
-            for user_id, user_data in threads_per_user.items():
-                user_info = user_data.get('user_info', {})
-                stats_data.append({
-                    'User ID': user_id[:8] + '...',
-                    'Full User ID': user_id,
-                    'Username': user_info.get('username', 'N/A'),
-                    'Email': user_info.get('email', 'N/A'),
-                    'Threads': user_data.get('thread_count', 0),
-                    'Total Messages': user_data.get('total_messages', 0),
-                    'Avg Msg/Thread': user_data.get('avg_messages_per_thread', 0),
-                    'First Thread': user_data.get('first_thread_time', 'N/A')[:10],
-                    'Last Thread': user_data.get('last_thread_time', 'N/A')[:10],
-                    'User Lifetime': user_data.get('user_lifetime_human', 'N/A')
-                })
-            
-            df_stats = pd.DataFrame(stats_data)
-            df_stats = df_stats.sort_values('Threads', ascending=False)
+            df_stats = _build_user_stats_df(report_cache_key(report_data), user_stats['threads_per_user'])
             st.dataframe(df_stats, use_container_width=True)
         else:
             st.info("Không có dữ liệu user statistics") 
\ No newline at end of file
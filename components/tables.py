@@ -4,36 +4,134 @@ Table components for Tebbi Analytics Dashboard
 
 import streamlit as st
 import pandas as pd
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+from io import BytesIO
+from itertools import islice
 from datetime import datetime
 from typing import Dict, List, Any
-from utils.data_processing import process_threads_data
+from utils.data_processing import process_threads_data, build_users_frame, first_non_empty, report_cache_key, DEBUG_UI
 
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _to_csv(df: pd.DataFrame) -> bytes:
+    """CSV cho nút download (cache theo nội dung DataFrame), ghi bằng writer C++ của pyarrow như _table_to_csv"""
+    buffer = BytesIO()
+    pa_csv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buffer)
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _table_to_csv(csv_key: str, _table: pa.Table) -> bytes:
+    """CSV cho nút download ghi thẳng từ Arrow Table (cache theo csv_key)"""
+    buffer = BytesIO()
+    pa_csv.write_csv(_table, buffer)
+    return buffer.getvalue()
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_date_df(report_key: str, _threads_by_date: dict) -> pd.DataFrame:
+    """Bảng threads theo ngày, mới nhất trước (cache theo report_key)"""
+    return pd.DataFrame(sorted(_threads_by_date.items(), reverse=True), columns=['Date', 'Threads'])
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_user_df(report_key: str, _threads_per_user: dict) -> pd.DataFrame:
+    """Bảng By User sort theo Thread Count (cache theo report_key)"""
+    return process_threads_data(_threads_per_user).sort_values('Thread Count', ascending=False, kind='mergesort')
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def _build_top_df(report_key: str, _top_users: List[dict]) -> pd.DataFrame:
+    """Bảng Top Users, luôn có cột Username (cache theo report_key)"""
+    df_top = pd.DataFrame(_top_users)
+    if df_top.empty:
+        return df_top
+    
+    # Đảm bảo luôn có cột Username: username -> phần trước @ của email -> 8 ký tự đầu user_id
+    user_info = df_top['user_info'] if 'user_info' in df_top else pd.Series(None, index=df_top.index, dtype=object)
+    email_prefix = user_info.str.get('email').fillna('').str.split('@').str[0]
+    uid_short = df_top['user_id'].astype(str).str.slice(0, 8)
+    df_top['Username'] = first_non_empty(
+        user_info.str.get('username'),
+        first_non_empty(email_prefix, uid_short)
+    )
+    return df_top
+
+def _build_all_users_df(threads_per_user: dict) -> pd.DataFrame:
+    """Bảng All Users (tab3) dựng vectorized từ threads_per_user, sort theo Thread Count"""
+    df = build_users_frame(threads_per_user).reindex(columns=[
+        'user_id', 'user_info.username', 'username', 'email', 'thread_count', 'total_messages', 'total_user_messages', 'last_active'
+    ])
+    username = first_non_empty(df['user_info.username'], df['username'].fillna(''))
+    email = df['email'].fillna('')
+    # Display Name: có email thì username -> phần trước @, không có email thì 8 ký tự đầu user_id
+    display_name = np.where(
+        email != '',
+        username.where(username != '', email.str.split('@').str[0]),
+        df['user_id'].str.slice(0, 8)
+    )
+    df_all_users = pd.DataFrame({
+        'STT': np.arange(1, len(df) + 1),
+        'User ID': df['user_id'],
+        'Display Name': display_name,
+        'Username': username,
+        'Email': email,
+        'Thread Count': df['thread_count'].fillna(0).astype('int64'),
+        'Total Messages': df['total_messages'].fillna(0).astype('int64'),
+        'User Messages': df['total_user_messages'].fillna(0).astype('int64'),
+        'Last Active': df['last_active'].fillna('N/A')
+    })
+    # Cột tìm kiếm gộp sẵn (lowercase) để lọc bằng một lần quét substring; ngăn cách bằng
+    # '\n' để từ khóa không khớp vắt qua hai field
+    df_all_users['_search'] = (
+        df_all_users['User ID'].astype(str) + '\n' + df_all_users['Username'] + '\n' +
+        df_all_users['Email'] + '\n' + df_all_users['Display Name'].fillna('')
+    ).str.lower()
+    # Cột chuỗi lưu dạng Arrow: bộ nhớ gọn hơn object, str.contains chạy kernel C của pyarrow
+    string_cols = ['User ID', 'Display Name', 'Username', 'Email', 'Last Active', '_search']
+    df_all_users[string_cols] = df_all_users[string_cols].astype('string[pyarrow]')
+    return df_all_users.sort_values('Thread Count', ascending=False, kind='mergesort')
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _build_all_users_table(report_key: str, _threads_per_user: dict) -> pa.Table:
+    """Arrow Table All Users (cache theo report_key)
+    
+    Table bất biến nên dùng chung qua cache_resource; lọc, thống kê và xuất CSV đều chạy
+    trên Arrow, st.dataframe nhận thẳng Table không cần chuyển từ pandas.
+    """
+    return pa.Table.from_pandas(_build_all_users_df(_threads_per_user), preserve_index=False)
+
+@st.fragment
 def display_data_tables(report_data: dict):
-    """Hiển thị bảng dữ liệu"""
+    """Hiển thị bảng dữ liệu (fragment: tìm kiếm/lọc chỉ rerun phần này)"""
     if not report_data:
         st.warning("⚠️ Không có dữ liệu để hiển thị")
         return
     
     st.subheader("📋 Data Tables")
+    report_key = report_cache_key(report_data)
+    
+    # Tag thời gian cho tên file download, tính một lần mỗi lần render
+    now = datetime.now()
+    day_tag = now.strftime('%Y%m%d')
+    minute_tag = now.strftime('%Y%m%d_%H%M')
     
     tab1, tab2, tab3, tab4 = st.tabs(["📅 By Date", "👥 By User", "📋 All Users", "🏆 Top Users"])
     
     with tab1:
         threads_by_date = report_data.get('threads_by_date', {})
         if threads_by_date:
-            df_date = pd.DataFrame(list(threads_by_date.items()), columns=['Date', 'Threads'])
-            df_date = df_date.sort_values('Date', ascending=False)
+            df_date = _build_date_df(report_key, threads_by_date)
             
             st.write(f"**📊 Tổng số ngày có hoạt động:** {len(df_date)}")
             st.dataframe(df_date, use_container_width=True, height=400)
             
             # Download button
-            csv = df_date.to_csv(index=False)
+            csv = _to_csv(df_date)
             st.download_button(
                 label="📥 Download CSV",
                 data=csv,
-                file_name=f"threads_by_date_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv"
+                file_name=f"threads_by_date_{day_tag}.csv",
+                mime="text/csv",
+                key="download_threads_by_date"
             )
         else:
             st.warning("⚠️ Không có dữ liệu theo ngày")
@@ -41,23 +139,20 @@ def display_data_tables(report_data: dict):
     with tab2:
         threads_per_user = report_data.get('threads_per_user', {})
         if threads_per_user:
-            df_user = process_threads_data(threads_per_user)
-            df_user = pd.DataFrame(df_user)
-            df_user = df_user.sort_values('Thread Count', ascending=False)
+            df_user = _build_user_df(report_key, threads_per_user)
             
             # Show statistics
             st.write(f"**👥 Tổng số users:** {len(df_user)}")
             st.write(f"**📊 Trong DataTable hiển thị:** {len(df_user)} users (tất cả)")
             
             # Debug: Show raw data count
-            with st.expander("🔍 Debug Info - Raw Data"):
-                st.write(f"**Raw threads_per_user keys:** {len(threads_per_user)}")
-                st.write(f"**DataFrame rows:** {len(df_user)}")
-                st.write("**First 5 User IDs from raw data:**")
-                user_ids_sample = list(threads_per_user.keys())[:5]
-                for uid in user_ids_sample:
-                    data = threads_per_user[uid]
-                    st.write(f"- {uid}: {data.get('thread_count', 0)} threads")
+            if DEBUG_UI:
+                with st.expander("🔍 Debug Info - Raw Data"):
+                    st.write(f"**Raw threads_per_user keys:** {len(threads_per_user)}")
+                    st.write(f"**DataFrame rows:** {len(df_user)}")
+                    st.write("**First 5 User IDs from raw data:**")
+                    for uid, data in islice(threads_per_user.items(), 5):
+                        st.write(f"- {uid}: {data.get('thread_count', 0)} threads")
             
             # Show top stats
             if not df_user.empty:
@@ -71,12 +166,13 @@ def display_data_tables(report_data: dict):
             st.dataframe(df_user, use_container_width=True, height=400)
             
             # Download button
-            csv = df_user.to_csv(index=False)
+            csv = _to_csv(df_user)
             st.download_button(
                 label="📥 Download CSV",
                 data=csv,
-                file_name=f"users_data_{datetime.now().strftime('%Y%m%d')}.csv",
-                mime="text/csv"
+                file_name=f"users_data_{day_tag}.csv",
+                mime="text/csv",
+                key="download_users_data"
             )
         else:
             st.warning("⚠️ Không có dữ liệu user")
@@ -87,35 +183,23 @@ def display_data_tables(report_data: dict):
         if threads_per_user:
             st.markdown("### 📋 Danh Sách Tất Cả Users")
             
-            # Create enhanced user dataframe
-            all_users_data = []
-            for user_id, data in threads_per_user.items():
-                username = data.get('user_info', {}).get('username', '') or data.get('username', '')
-                all_users_data.append({
-                    'STT': len(all_users_data) + 1,
-                    'User ID': user_id,
-                    'Display Name': username or data.get('email', '').split('@')[0] if data.get('email') else user_id[:8],
-                    'Username': username,
-                    'Email': data.get('email', ''),
-                    'Thread Count': data.get('thread_count', 0),
-                    'Total Messages': data.get('total_messages', 0),
-                    'User Messages': data.get('total_user_messages', 0),
-                    'Last Active': data.get('last_active', 'N/A')
-                })
-            
-            df_all_users = pd.DataFrame(all_users_data)
-            df_all_users = df_all_users.sort_values('Thread Count', ascending=False)
+            # Create enhanced user table
+            all_users_table = _build_all_users_table(report_key, threads_per_user)
+            search_blob = all_users_table.column('_search')
+            all_users_table = all_users_table.select([name for name in all_users_table.column_names if name != '_search'])
+            thread_counts = all_users_table.column('Thread Count')
+            total_users = all_users_table.num_rows
             
             # Summary statistics
             col1, col2, col3, col4 = st.columns(4)
             with col1:
-                st.metric("👥 Tổng Users", len(df_all_users))
+                st.metric("👥 Tổng Users", total_users)
             with col2:
-                st.metric("📊 TB Threads/User", f"{df_all_users['Thread Count'].mean():.1f}")
+                st.metric("📊 TB Threads/User", f"{pc.mean(thread_counts).as_py():.1f}")
             with col3:
-                st.metric("🏆 Max Threads", df_all_users['Thread Count'].max())
+                st.metric("🏆 Max Threads", pc.max(thread_counts).as_py())
             with col4:
-                active_users = len(df_all_users[df_all_users['Thread Count'] > 0])
+                active_users = pc.sum(pc.greater(thread_counts, 0)).as_py()
                 st.metric("✅ Active Users", active_users)
             
             # Search and filter
@@ -128,30 +212,30 @@ def display_data_tables(report_data: dict):
             with col2:
                 min_threads = st.number_input("Tối thiểu threads:", min_value=0, max_value=100, value=0)
             
-            # Apply filters
-            filtered_df = df_all_users.copy()
-            
-            if search_term:
-                mask = (
-                    filtered_df['User ID'].str.contains(search_term, case=False, na=False) |
-                    filtered_df['Username'].str.contains(search_term, case=False, na=False) |
-                    filtered_df['Email'].str.contains(search_term, case=False, na=False) |
-                    filtered_df['Display Name'].str.contains(search_term, case=False, na=False)
-                )
-                filtered_df = filtered_df[mask]
-            
-            if min_threads > 0:
-                filtered_df = filtered_df[filtered_df['Thread Count'] >= min_threads]
+            # Apply filters: gộp một mask rồi lọc một lần; không lọc thì dùng thẳng table gốc
+            is_filtered = bool(search_term) or min_threads > 0
+            filtered_table = all_users_table
+            if is_filtered:
+                mask = None
+                if search_term:
+                    mask = pc.match_substring(search_blob, search_term.lower())
+                if min_threads > 0:
+                    min_mask = pc.greater_equal(thread_counts, min_threads)
+                    mask = min_mask if mask is None else pc.and_(mask, min_mask)
+                filtered_table = all_users_table.filter(mask)
+            # Filter khớp toàn bộ users thì coi như không lọc (không cần CSV riêng)
+            has_filtered_rows = is_filtered and filtered_table.num_rows != total_users
             
             # Show filtered results info
-            if len(filtered_df) != len(df_all_users):
-                st.info(f"🔍 Hiển thị {len(filtered_df)}/{len(df_all_users)} users (đã lọc)")
+            if has_filtered_rows:
+                st.info(f"🔍 Hiển thị {filtered_table.num_rows}/{total_users} users (đã lọc)")
             else:
-                st.info(f"📋 Hiển thị tất cả {len(df_all_users)} users")
+                st.info(f"📋 Hiển thị tất cả {total_users} users")
             
-            # Display the full table
+            # Display the full table (key cố định: đổi bộ lọc chỉ cập nhật data, không mount lại grid)
             st.dataframe(
-                filtered_df,
+                filtered_table,
+                key="all_users_table",
                 use_container_width=True,
                 height=500,
                 column_config={
@@ -171,22 +255,24 @@ def display_data_tables(report_data: dict):
             # Download options
             col1, col2 = st.columns(2)
             with col1:
-                csv_all = df_all_users.to_csv(index=False)
+                csv_all = _table_to_csv(report_key, all_users_table)
                 st.download_button(
                     label="📥 Download All Users CSV",
                     data=csv_all,
-                    file_name=f"all_users_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                    mime="text/csv"
+                    file_name=f"all_users_{minute_tag}.csv",
+                    mime="text/csv",
+                    key="download_all_users"
                 )
             
             with col2:
-                if len(filtered_df) != len(df_all_users):
-                    csv_filtered = filtered_df.to_csv(index=False)
+                if has_filtered_rows:
+                    csv_filtered = _table_to_csv(f"{report_key}|{search_term}|{min_threads}", filtered_table)
                     st.download_button(
                         label="📥 Download Filtered CSV",
                         data=csv_filtered,
-                        file_name=f"filtered_users_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                        mime="text/csv"
+                        file_name=f"filtered_users_{minute_tag}.csv",
+                        mime="text/csv",
+                        key="download_filtered_users"
                     )
         else:
             st.warning("⚠️ Không có dữ liệu users")
@@ -194,17 +280,8 @@ def display_data_tables(report_data: dict):
     with tab4:
         top_users = report_data.get('top_users', [])
         if top_users:
-            df_top = pd.DataFrame(top_users)
+            df_top = _build_top_df(report_key, top_users)
             if not df_top.empty:
-                # Đảm bảo luôn có cột Username
-                def get_username(user_info, user_id):
-                    if isinstance(user_info, dict):
-                        if user_info.get('username'):
-                            return user_info['username']
-                        elif user_info.get('email'):
-                            return user_info['email'].split('@')[0]
-                    return user_id[:8]
-                df_top['Username'] = df_top.apply(lambda row: get_username(row.get('user_info', {}), row.get('user_id', '')), axis=1)
                 st.write(f"**🏆 Top users:** {len(df_top)}")
                 st.dataframe(df_top, use_container_width=True, height=400)
         else:
@@ -2,17 +2,52 @@
 Data processing utilities for Tebbi Analytics Dashboard
 """
 
+import os
 import pandas as pd
+import streamlit as st
 from datetime import datetime
 from collections import Counter, defaultdict
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Tuple
 import numpy as np
 
+# Bật các khối debug trên UI (raw data, metadata) bằng TEBBI_DEBUG=1, mặc định ẩn
+DEBUG_UI = os.environ.get('TEBBI_DEBUG') == '1'
+
+def report_cache_key(report_data: dict) -> str:
+    """Khóa cache rẻ cho một report: dùng analysis_date, fallback về id của dict"""
+    summary = report_data.get('summary', {}) if report_data else {}
+    return summary.get('analysis_date') or f"id:{id(report_data)}"
+
+def tool_stats_cache_key(tool_calling_stats: dict, report_data: Optional[dict] = None) -> str:
+    """Khóa cache rẻ cho tool_calling_stats: report_cache_key + các bộ đếm tổng + kích thước + call_id đầu/cuối
+
+    Cache dùng chung giữa các session nên phải gắn danh tính report; không có report thì fallback về id của dict.
+    """
+    report_key = report_cache_key(report_data) if report_data else f"id:{id(tool_calling_stats)}"
+    detailed_calls = tool_calling_stats.get('detailed_calls') or []
+    return report_key + "|" + ":".join(str(part) for part in (
+        tool_calling_stats.get('total_tool_calls', 0),
+        tool_calling_stats.get('create_lead', 0),
+        tool_calling_stats.get('send_html_email', 0),
+        tool_calling_stats.get('threads_with_any_tool', 0),
+        len(tool_calling_stats.get('tool_calls_by_thread') or {}),
+        len(tool_calling_stats.get('tool_calls_by_date') or {}),
+        len(detailed_calls),
+        detailed_calls[0].get('call_id', '') if detailed_calls else '',
+        detailed_calls[-1].get('call_id', '') if detailed_calls else ''
+    ))
+
+def conversations_cache_key(conversations_data: List[dict]) -> str:
+    """Khóa cache rẻ cho list conversations: số lượng + thread_id đầu/cuối"""
+    if not conversations_data:
+        return "empty"
+    return f"{len(conversations_data)}:{conversations_data[0].get('thread_id', '')}:{conversations_data[-1].get('thread_id', '')}"
+
 def get_user_display_name(user_info: dict, user_id: str = None) -> str:
     """Lấy tên hiển thị cho user từ metadata"""
-    name = user_info.get('name', '').strip()
-    username = user_info.get('username', '').strip()
-    email = user_info.get('email', '').strip()
+    name = (user_info.get('name') or '').strip()
+    username = (user_info.get('username') or '').strip()
+    email = (user_info.get('email') or '').strip()
     
     if name:
         return name.upper()
@@ -25,20 +60,56 @@ def get_user_display_name(user_info: dict, user_id: str = None) -> str:
     else:
         return "UNKNOWN_USER"
 
-def process_threads_data(threads_per_user: dict) -> List[dict]:
+def build_users_frame(threads_per_user: dict) -> pd.DataFrame:
+    """Bảng phẳng một dòng/user từ threads_per_user (user_info.* tách thành cột), giữ thứ tự dict"""
+    df = pd.json_normalize(list(threads_per_user.values()), max_level=1)
+    df.insert(0, 'user_id', pd.Series(list(threads_per_user.keys()), dtype=object))
+    return df
+
+def first_non_empty(primary: pd.Series, fallback: pd.Series) -> pd.Series:
+    """Bản vectorized của `primary or fallback` cho cột chuỗi: None/NaN/'' coi như rỗng"""
+    primary = primary.fillna('')
+    return primary.where(primary != '', fallback)
+
+def process_threads_data(threads_per_user: dict) -> pd.DataFrame:
     """Process threads data for visualization"""
-    data = []
-    for user_id, info in threads_per_user.items():
-        username = info.get('user_info', {}).get('username', '') or info.get('username', '')
-        data.append({
-            'User ID': user_id,
-            'Username': username,
-            'Email': info.get('email', ''),
-            'Thread Count': info.get('thread_count', 0),
-            'Total Messages': info.get('total_messages', 0),
-            'User Messages': info.get('total_user_messages', 0)
-        })
-    return data
+    df = build_users_frame(threads_per_user).reindex(columns=[
+        'user_id', 'user_info.username', 'username', 'email', 'thread_count', 'total_messages', 'total_user_messages'
+    ])
+    return pd.DataFrame({
+        'User ID': df['user_id'],
+        'Username': first_non_empty(df['user_info.username'], df['username'].fillna('')),
+        'Email': df['email'].fillna(''),
+        'Thread Count': df['thread_count'].fillna(0).astype('int64'),
+        'Total Messages': df['total_messages'].fillna(0).astype('int64'),
+        'User Messages': df['total_user_messages'].fillna(0).astype('int64')
+    })
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def build_user_summary_df(report_key: str, _threads_per_user: dict) -> pd.DataFrame:
+    """Bảng tóm tắt user dùng chung cho các chart top users (cache theo report_key)"""
+    infos = list(_threads_per_user.values())
+    user_infos = [info.get('user_info') or {} for info in infos]
+    # Dựng thẳng từng cột từ list, không tạo dict trung gian cho mỗi user
+    df = pd.DataFrame({
+        'user_id': list(_threads_per_user.keys()),
+        'display_name': [info.get('display_name') for info in infos],
+        'user_info.username': [user_info.get('username') for user_info in user_infos],
+        'user_info.email': [user_info.get('email') for user_info in user_infos],
+        'total_messages': [info.get('total_messages', 0) for info in infos],
+        'thread_count': [info.get('thread_count', 0) for info in infos]
+    }, copy=False)
+
+    # Dùng display_name tính sẵn lúc ingest, report cũ thì fallback:
+    # username -> phần trước @ của email -> 8 ký tự đầu user_id
+    precomputed = df['display_name'].astype('string')
+    if precomputed.notna().all():
+        df['display_name'] = precomputed
+    else:
+        username = df['user_info.username'].astype('string').replace('', pd.NA)
+        email_prefix = df['user_info.email'].astype('string').replace('', pd.NA).str.split('@').str[0]
+        df['display_name'] = precomputed.fillna(username).fillna(email_prefix).fillna(df['user_id'].astype('string').str.slice(0, 8))
+    return df[['user_id', 'display_name', 'total_messages', 'thread_count']]
 
 def process_messages_by_date(report_data: dict) -> dict:
     """Process messages data by date"""
@@ -73,13 +144,17 @@ def organize_conversations_by_user(conversations_data: List[dict]) -> Dict[str,
         users_conversations[user_id].append(conv)
     return users_conversations
 
-def process_user_options(users_conversations: dict, threads_per_user: dict) -> dict:
-    """Process user options for display"""
-    user_options = {}
-    for user_id, convs in users_conversations.items():
-        user_info = {}
-        if user_id in threads_per_user:
-            user_info = threads_per_user[user_id].get('user_info', {})
-        display_name = get_user_display_name(user_info, user_id)
-        user_options[f"{display_name}"] = user_id
-    return user_options 
\ No newline at end of file
+def process_user_options(users_conversations: dict, threads_per_user: dict) -> List[Tuple[str, str]]:
+    """Process user options for display: list (display_name, user_id) theo thứ tự users_conversations"""
+    return [
+        (get_user_display_name((threads_per_user.get(user_id) or {}).get('user_info') or {}, user_id), user_id)
+        for user_id in users_conversations
+    ]
+
+@st.cache_data(show_spinner=False, max_entries=8, ttl=600)
+def build_conversation_index(conv_key: str, report_key: str, _conversations_data: List[dict], _threads_per_user: dict) -> Tuple[Dict[str, List[int]], List[Tuple[str, str]]]:
+    """Vị trí conversations theo user và user options (cache theo conv_key, report_key)"""
+    positions = defaultdict(list)
+    for i, conv in enumerate(_conversations_data):
+        positions[conv.get('metadata', {}).get('user_id', 'Unknown')].append(i)
+    return dict(positions), process_user_options(positions, _threads_per_user)
@@ -3,7 +3,9 @@ Date utility functions for the Tebbi Analytics application
 """
 
 from datetime import datetime, date
-from typing import Optional, Union
+from typing import Any, Dict, List, Optional, Union
+import numpy as np
+import pandas as pd
 
 def parse_date_range(date_str: str, start_date: Union[date, datetime], end_date: Union[date, datetime]) -> bool:
     """
@@ -39,4 +41,39 @@ def parse_date_range(date_str: str, start_date: Union[date, datetime], end_date:
         return start_date <= parsed_date <= end_date
         
     except (ValueError, TypeError):
-        return False 
\ No newline at end of file
+        return False 
+
+def filter_threads_by_updated_date(
+    threads: List[Dict[str, Any]],
+    date_from: Optional[Union[date, datetime, str]] = None,
+    date_to: Optional[Union[date, datetime, str]] = None
+) -> List[Dict[str, Any]]:
+    """
+    Filter threads whose updated_at date falls within [date_from, date_to], vectorized.
+    
+    The date compared is the calendar date written in the timestamp itself (same as
+    datetime.fromisoformat(...).date()); threads with a missing or unparseable
+    updated_at are dropped.
+    
+    Args:
+        threads (List[Dict]): Threads from the threads/search API
+        date_from (date|datetime|str, optional): Inclusive lower bound (YYYY-MM-DD if str)
+        date_to (date|datetime|str, optional): Inclusive upper bound (YYYY-MM-DD if str)
+        
+    Returns:
+        List[Dict]: Matching threads, in their original order
+    """
+    if not date_from and not date_to:
+        return threads
+    
+    updated_at = pd.Series([thread.get('updated_at') for thread in threads], dtype=object)
+    # Chuỗi ISO hợp lệ mới được giữ; ngày lấy từ 10 ký tự đầu để không bị đổi múi giờ
+    valid = pd.to_datetime(updated_at, utc=True, format='ISO8601', errors='coerce').notna()
+    thread_dates = pd.to_datetime(updated_at.str.slice(0, 10), format='%Y-%m-%d', errors='coerce')
+    
+    mask = valid & thread_dates.notna()
+    if date_from:
+        mask &= thread_dates >= pd.Timestamp(date_from).normalize()
+    if date_to:
+        mask &= thread_dates <= pd.Timestamp(date_to).normalize()
+    return [threads[i] for i in np.flatnonzero(mask.to_numpy())]
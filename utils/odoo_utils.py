@@ -1,5 +1,7 @@
+import orjson
 import requests
 import pandas as pd
+from requests.adapters import HTTPAdapter
 import streamlit as st
 from datetime import date, timedelta
 
@@ -31,33 +33,104 @@ STAGE_IDS = {
     9: "Follow Up"
 }
 
-def get_odoo_leads(date_from=None, date_to=None, state=None, tags=None, limit=1000):
-    """Lấy danh sách lead từ Odoo qua JSON-RPC, trả về DataFrame"""
-    ODOO_URL = st.secrets["ODOO_URL"]
-    ODOO_DB = st.secrets["ODOO_DB"]
-    ODOO_USER = st.secrets["ODOO_USER"]
-    ODOO_PASSWORD = st.secrets["ODOO_PASSWORD"]
-    if not all([ODOO_URL, ODOO_DB, ODOO_USER, ODOO_PASSWORD]):
-        return None, "Chưa cấu hình đủ thông tin Odoo trong biến môi trường!"
+# Các field lấy về từ crm.lead (cũng là schema cột của DataFrame)
+LEAD_FIELDS = [
+    "id", "create_date", "stage_id", "tag_ids", "name", "email_from", "phone", "contact_name", "description", "create_uid"
+]
+
+# Số lead mỗi lần search_read
+ODOO_PAGE_SIZE = 200
+
+class OdooAuthError(Exception):
+    """Đăng nhập Odoo không thành công (message hiển thị thẳng cho người dùng)"""
+
+
+@st.cache_resource(show_spinner=False)
+def _odoo_session() -> requests.Session:
+    """Session Odoo đã đăng nhập, dùng chung giữa các rerun
+    
+    Connection pool keep-alive + cookie session_id gắn sẵn trong header. Lỗi thì raise
+    nên không bị cache, lần gọi sau sẽ đăng nhập lại.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
     auth_data = {
         "jsonrpc": "2.0",
         "method": "call",
         "params": {
-            "db": ODOO_DB,
-            "login": ODOO_USER,
-            "password": ODOO_PASSWORD
+            "db": st.secrets["ODOO_DB"],
+            "login": st.secrets["ODOO_USER"],
+            "password": st.secrets["ODOO_PASSWORD"]
         },
         "id": 1
     }
-    auth_url = f"{ODOO_URL}/web/session/authenticate"
+    auth_response = session.post(f"{st.secrets['ODOO_URL']}/web/session/authenticate", json=auth_data)
+    auth_res = orjson.loads(auth_response.content)
+    if not auth_res.get('result') or not auth_res['result'].get('uid'):
+        raise OdooAuthError("Đăng nhập Odoo thất bại!")
+    session_id = auth_response.cookies.get('session_id')
+    if not session_id:
+        raise OdooAuthError("Không lấy được session_id từ Odoo!")
+    session.headers.update({'Content-Type': 'application/json', 'Cookie': f'session_id={session_id}'})
+    return session
+
+@st.cache_data(ttl=300, show_spinner=False)
+def _fetch_odoo_leads(domain: list, limit: int) -> pd.DataFrame:
+    """Gọi search_read crm.lead theo từng trang ODOO_PAGE_SIZE lead (cache 5 phút theo domain + limit)"""
+    session = _odoo_session()
+    dataset_url = f"{st.secrets['ODOO_URL']}/web/dataset/call_kw"
+    frames = []
+    offset = 0
+    while offset < limit:
+        page_limit = min(ODOO_PAGE_SIZE, limit - offset)
+        payload = {
+            "jsonrpc": "2.0",
+            "method": "call",
+            "params": {
+                "model": "crm.lead",
+                "method": "search_read",
+                "args": [],
+                "kwargs": {
+                    "domain": domain,
+                    "fields": LEAD_FIELDS,
+                    "offset": offset,
+                    "limit": page_limit,
+                    # Thứ tự mặc định (priority desc, id desc) đổi được giữa các trang, sort theo id để offset ổn định
+                    "order": "id desc"
+                }
+            },
+            "id": 2
+        }
+        res = orjson.loads(session.post(dataset_url, json=payload).content)
+        if res.get('error'):
+            # Thường là session hết hạn: bỏ session đã cache để lần sau đăng nhập lại
+            _odoo_session.clear()
+            raise Exception(res['error'].get('message', res['error']))
+        leads = res.get('result', [])
+        if leads:
+            frames.append(pd.DataFrame.from_records(leads, columns=LEAD_FIELDS))
+        if len(leads) < page_limit:
+            break
+        offset += page_limit
+    if not frames:
+        return pd.DataFrame()
+    return pd.concat(frames, ignore_index=True)
+
+def get_odoo_leads(date_from=None, date_to=None, state=None, tags=None, limit=1000):
+    """Lấy danh sách lead từ Odoo qua JSON-RPC, trả về (DataFrame, lỗi)"""
+    ODOO_URL = st.secrets["ODOO_URL"]
+    ODOO_DB = st.secrets["ODOO_DB"]
+    ODOO_USER = st.secrets["ODOO_USER"]
+    ODOO_PASSWORD = st.secrets["ODOO_PASSWORD"]
+    if not all([ODOO_URL, ODOO_DB, ODOO_USER, ODOO_PASSWORD]):
+        return None, "Chưa cấu hình đủ thông tin Odoo trong biến môi trường!"
+    # 1. Đăng nhập (session được cache_resource dùng lại giữa các rerun)
     try:
-        auth_response = requests.post(auth_url, json=auth_data)
-        auth_res = auth_response.json()
-        if not auth_res.get('result') or not auth_res['result'].get('uid'):
-            return None, "Đăng nhập Odoo thất bại!"
-        session_id = auth_response.cookies.get('session_id')
-        if not session_id:
-            return None, "Không lấy được session_id từ Odoo!"
+        _odoo_session()
+    except OdooAuthError as e:
+        return None, str(e)
     except Exception as e:
         return None, f"Lỗi khi đăng nhập Odoo: {e}"
     # 2. Build domain filter
@@ -72,33 +145,9 @@ def get_odoo_leads(date_from=None, date_to=None, state=None, tags=None, limit=10
         domain.append(['tag_ids', 'in', tags])
     # Lọc theo tên người tạo là 'AI Lead Generation'
     domain.append(['create_uid.name', '=', 'AI Lead Generation'])
-    # 3. Call search_read
-    headers = {'Content-Type': 'application/json', 'Cookie': f'session_id={session_id}'}
-    dataset_url = f"{ODOO_URL}/web/dataset/call_kw"
-    payload = {
-        "jsonrpc": "2.0",
-        "method": "call",
-        "params": {
-            "model": "crm.lead",
-            "method": "search_read",
-            "args": [],
-            "kwargs": {
-                "domain": domain,
-                "fields": [
-                    "id", "create_date", "stage_id", "tag_ids", "name", "email_from", "phone", "contact_name", "description", "create_uid"
-                ],
-                "limit": limit
-            }
-        },
-        "id": 2
-    }
+    # 3. Call search_read (cache theo domain + limit)
     try:
-        res = requests.post(dataset_url, json=payload, headers=headers).json()
-        leads = res.get('result', [])
-        if not leads:
-            return pd.DataFrame(), None
-        df = pd.DataFrame(leads)
-        return df, None
+        return _fetch_odoo_leads(domain, limit), None
     except Exception as e:
         return None, f"Lỗi khi lấy danh sách lead: {e}"
 
@@ -113,4 +162,10 @@ def map_stage(stage):
         return stage[1]
     if isinstance(stage, int):
         return STAGE_IDS.get(stage, str(stage))
-    return str(stage) 
\ No newline at end of file
+    return str(stage) 
+
+def explode_tag_names(tag_ids: pd.Series) -> pd.Series:
+    """Bản vectorized của map_tags cho cả cột: tên tag dạng exploded, index là index dòng gốc"""
+    exploded = tag_ids.explode()
+    ids = exploded[exploded.notna() & exploded.astype(bool)]
+    return ids.map(TAG_IDS).fillna(ids.map(str))
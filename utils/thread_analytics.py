@@ -5,18 +5,24 @@ Tự động lấy và phân tích dữ liệu threads từ API
 """
 
 import requests
+from requests.adapters import HTTPAdapter
 import json
+import orjson
 from datetime import datetime, timedelta
 from collections import defaultdict, Counter
 import pandas as pd
-from typing import Dict, List, Any, Optional
+from typing import Dict, List, Any, Optional, Iterator
 import argparse
 import os
 import time
 import shutil
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from itertools import islice
 import streamlit as st
 
+# Số connection keep-alive tối thiểu giữ trong pool HTTP
+HTTP_POOL_MAXSIZE = 32
+
 
 class ThreadAnalytics:
     """
@@ -34,6 +40,12 @@ class ThreadAnalytics:
         self.max_workers = max_workers
         self.session = requests.Session()
         self.session.headers.update({'Content-Type': 'application/json'})
+        # Pool keep-alive đủ cho max_workers request song song (mặc định requests chỉ giữ 10);
+        # instance được dùng chung giữa các session nên giữ tối thiểu HTTP_POOL_MAXSIZE connection
+        pool_size = max(max_workers, HTTP_POOL_MAXSIZE)
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
         self._ensure_directory_structure()
     
     def _ensure_directory_structure(self):
@@ -81,20 +93,28 @@ class ThreadAnalytics:
         try:
             response = self.session.post(url, json=payload)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             return data if isinstance(data, list) else []
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             print(f"Lỗi khi gọi API: {e}")
             return []
     
     def fetch_all_threads(self, date_from: str = None, date_to: str = None) -> List[Dict[str, Any]]:
         """Lấy tất cả threads với phân trang và filter ngày"""
         all_threads = []
-        offset = 0
-        limit = 1000
         
         print("Đang lấy dữ liệu threads...")
         
+        for threads in self.iter_thread_pages(date_from, date_to):
+            all_threads.extend(threads)
+        
+        print(f"Đã lấy được {len(all_threads)} threads")
+        return all_threads
+    
+    def iter_thread_pages(self, date_from: str = None, date_to: str = None, limit: int = 1000) -> Iterator[List[Dict[str, Any]]]:
+        """Lấy threads theo từng trang (generator), filter ngày ngay trên từng trang"""
+        offset = 0
+        
         while True:
             print(f"  Lấy từ {offset} đến {offset + limit}")
             threads = self.fetch_threads(limit=limit, offset=offset)
@@ -105,14 +125,11 @@ class ThreadAnalytics:
             # Filter by date if specified
             if date_from or date_to:
                 threads = self._filter_threads_by_date(threads, date_from, date_to)
-                
-            all_threads.extend(threads)
+            
+            yield threads
             
             offset += limit
             time.sleep(0.1)  # Avoid server overload
-        
-        print(f"Đã lấy được {len(all_threads)} threads")
-        return all_threads
     
     def _filter_threads_by_date(self, threads: List[Dict[str, Any]], date_from: str = None, date_to: str = None) -> List[Dict[str, Any]]:
         """Filter threads theo khoảng thời gian"""
@@ -151,9 +168,9 @@ class ThreadAnalytics:
         try:
             response = self.session.get(url)
             response.raise_for_status()
-            data = response.json()
+            data = orjson.loads(response.content)
             return data if isinstance(data, list) else []
-        except requests.exceptions.RequestException as e:
+        except (requests.exceptions.RequestException, orjson.JSONDecodeError) as e:
             print(f"Lỗi khi lấy history cho thread {thread_id}: {e}")
             return []
     
@@ -362,10 +379,15 @@ class ThreadAnalytics:
             total_messages = sum(thread_conversations.get(tid, {}).get('total_messages', 0) for tid in thread_ids)
             total_user_messages = sum(thread_conversations.get(tid, {}).get('user_messages', 0) for tid in thread_ids)
 
+            # Tính sẵn tên hiển thị một lần để các chart chỉ việc đọc lại (không ghi vào user_info)
+            user_info = user_details.get(user_id, {})
+            email = user_info.get('email') or ''
+
             user_stats['threads_per_user'][user_id] = {
                 'thread_count': thread_count,
                 'thread_ids': thread_ids,
-                'user_info': user_details.get(user_id, {}),
+                'user_info': user_info,
+                'display_name': user_info.get('username') or (email.split('@')[0] if email else user_id[:8]),
                 'total_messages': total_messages,
                 'total_user_messages': total_user_messages,
                 'avg_messages_per_thread': round(total_messages / thread_count, 2) if thread_count > 0 else 0
@@ -504,7 +526,7 @@ class ThreadAnalytics:
             f.write("📅 THREADS THEO NGÀY (10 ngày gần nhất):\n")
             f.write("-" * 40 + "\n")
             threads_by_date = report['threads_by_date']
-            recent_dates = list(threads_by_date.items())[-10:]
+            recent_dates = list(islice(reversed(threads_by_date.items()), 10))[::-1]
             for date, count in recent_dates:
                 f.write(f"{date}: {count:,} threads\n")
         
@@ -656,6 +678,19 @@ class ThreadAnalytics:
             f.write("CONVERSATION HISTORY:\n")
             f.write("="*80 + "\n")
             
+            # Parse mỗi timestamp khác nhau một lần (messages cùng snapshot history dùng chung created_at)
+            formatted_times = {
+                timestamp: self._format_export_timestamp(timestamp)
+                for timestamp in {msg.get('timestamp', '') for msg in conversation}
+                if timestamp
+            }
+            
+            # Nhãn user giống nhau cho mọi message của thread, tính một lần
+            display_name = (user_metadata.get('name', '') or 
+                          user_metadata.get('username', '') or 
+                          user_metadata.get('email', '').split('@')[0] if user_metadata.get('email') else 'USER')
+            user_icon = f"👤 {display_name.upper()}"
+            
             # Write messages
             for j, msg in enumerate(conversation, 1):
                 role = msg['role']
@@ -663,22 +698,11 @@ class ThreadAnalytics:
                 timestamp = msg.get('timestamp', '')
                 
                 # Format role display
-                if role == "User":
-                    display_name = (user_metadata.get('name', '') or 
-                                  user_metadata.get('username', '') or 
-                                  user_metadata.get('email', '').split('@')[0] if user_metadata.get('email') else 'USER')
-                    icon = f"👤 {display_name.upper()}"
-                else:
-                    icon = "🤖 AI"
+                icon = user_icon if role == "User" else "🤖 AI"
                 
                 f.write(f"\n[{j:03d}] {icon}")
                 if timestamp:
-                    try:
-                        dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-                        formatted_time = dt.strftime('%Y-%m-%d %H:%M:%S')
-                        f.write(f" - {formatted_time}")
-                    except:
-                        f.write(f" - {timestamp}")
+                    f.write(f" - {formatted_times[timestamp]}")
                 f.write("\n")
                 
                 # Write content with line wrapping
@@ -687,6 +711,13 @@ class ThreadAnalytics:
                 if j < len(conversation):
                     f.write("    " + "·"*50 + "\n")
     
+    def _format_export_timestamp(self, timestamp: str) -> str:
+        """Format timestamp ISO cho file export, không parse được thì giữ nguyên"""
+        try:
+            return datetime.fromisoformat(timestamp.replace('Z', '+00:00')).strftime('%Y-%m-%d %H:%M:%S')
+        except (ValueError, AttributeError, TypeError):
+            return str(timestamp)
+    
     def _write_wrapped_content(self, f, content: str):
         """Write content with proper line wrapping"""
         lines = content.split('\n')
@@ -758,7 +789,7 @@ class ThreadAnalytics:
         print("\n📅 THREADS THEO NGÀY (10 ngày gần nhất):")
         print("-" * 40)
         threads_by_date = report['threads_by_date']
-        recent_dates = list(threads_by_date.items())[-10:]
+        recent_dates = list(islice(reversed(threads_by_date.items()), 10))[::-1]
         for date, count in recent_dates:
             print(f"{date}: {count:,} threads")
         
@@ -969,6 +1000,7 @@ class ThreadAnalytics:
             'threads_with_send_html_email': 0,
             'threads_with_any_tool': 0,
             'tool_calls_by_thread': {},
+            'threads_with_tools': {},  # Chỉ các thread có total_tool_calls > 0, để UI không phải lọc lại
             'tool_calls_by_date': defaultdict(lambda: {
                 'create_lead': 0, 'send_html_email': 0, 'total': 0
             }),
@@ -1019,6 +1051,8 @@ class ThreadAnalytics:
                 'updated_at': thread.get('updated_at', ''),
                 'tool_stats': thread_tool_stats
             }
+            if thread_tool_stats.get('total_tool_calls', 0) > 0:
+                total_stats['threads_with_tools'][thread_id] = total_stats['tool_calls_by_thread'][thread_id]
             
             # Thống kê theo ngày
             created_at = thread.get('created_at', '')
@@ -1148,16 +1182,16 @@ def cleanup_output_files(keep_latest: int = 3, base_dir: str = "reports"):
         print(f"⚠️ Thư mục {base_dir} không tồn tại")
         return
     
-    # Get list of date directories
+    # Get list of date directories (scandir: is_dir() dùng kết quả stat có sẵn của DirEntry)
     date_dirs = []
-    for item in os.listdir(base_dir):
-        item_path = os.path.join(base_dir, item)
-        if os.path.isdir(item_path) and len(item) == 10 and item.count('-') == 2:  # YYYY-MM-DD format
-            try:
-                date_obj = datetime.strptime(item, '%Y-%m-%d')
-                date_dirs.append((date_obj, item_path))
-            except ValueError:
-                continue
+    with os.scandir(base_dir) as entries:
+        for entry in entries:
+            if len(entry.name) == 10 and entry.name.count('-') == 2 and entry.is_dir():  # YYYY-MM-DD format
+                try:
+                    date_obj = datetime.strptime(entry.name, '%Y-%m-%d')
+                    date_dirs.append((date_obj, entry.path))
+                except ValueError:
+                    continue
     
     # Sort by date (newest first)
     date_dirs.sort(key=lambda x: x[0], reverse=True)
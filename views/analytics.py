@@ -3,6 +3,11 @@ Analytics page for Tebbi Analytics Dashboard
 """
 
 import streamlit as st
+import gc
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta, date
 from typing import Dict, List, Any, Optional, Tuple
 import pandas as pd
@@ -22,7 +27,8 @@ from components.charts import (
 )
 from components.conversations import display_conversations_browser
 from components.tables import display_data_tables
-from utils.date_utils import parse_date_range
+from utils.date_utils import parse_date_range, filter_threads_by_updated_date
+from utils.data_processing import DEBUG_UI
 
 def display_welcome_message():
     """Hiển thị thông báo chào mừng"""
@@ -79,11 +85,123 @@ def display_date_filter() -> Tuple[date, date]:
     
     return date_from, date_to
 
-@st.cache_data(ttl=300)  # Cache 5 phút
+# Số request history chạy song song khi tải conversations (I/O-bound)
+CONVERSATION_FETCH_WORKERS = 16
+
+@st.cache_resource(show_spinner=False)
+def get_analytics() -> ThreadAnalytics:
+    """Client ThreadAnalytics dùng chung (giữ requests.Session + connection pool giữa các lần gọi)"""
+    return ThreadAnalytics(max_workers=CONVERSATION_FETCH_WORKERS)
+
+# TTL cache báo cáo threads cho khoảng còn chứa hôm nay (giây)
+OPEN_RANGE_TTL = 300
+# TTL cache cho khoảng đã qua (giây): lọc theo updated_at nên khoảng cũ vẫn đổi khi thread được cập nhật
+CLOSED_RANGE_TTL = 60 * 60
+
+# Số khoảng ngày tối đa giữ báo cáo cũ cho stale-while-revalidate (LRU)
+LAST_REPORTS_MAX = 4
+
+# Báo cáo tốt gần nhất theo (date_from, date_to) -> (report, filtered_threads, thời điểm lấy),
+# dùng để trả bản cũ trong lúc refresh nền khi cache đã hết hạn
+_last_reports: "OrderedDict[Tuple, Tuple[Dict, List, float]]" = OrderedDict()
+_refreshing = set()
+_last_reports_lock = threading.Lock()
+
+class _UncachedResult(Exception):
+    """Kết quả lỗi/rỗng, không lưu vào cache dài hạn"""
+
 def fetch_and_analyze_threads(date_from: Optional[date] = None, date_to: Optional[date] = None) -> Tuple[Dict, List]:
+    """Fetch và analyze threads, chọn cache theo khoảng thời gian
+    
+    Khoảng còn mở: cache hết hạn chưa quá 1 TTL thì trả ngay báo cáo cũ và refresh ở thread nền
+    (stale-while-revalidate), chỉ chờ fetch khi chưa có báo cáo nào dùng được.
+    """
+    if _is_closed_range(date_to):
+        return _fetch_report(date_from, date_to)
+    key = (date_from, date_to)
+    with _last_reports_lock:
+        _prune_last_reports()
+        entry = _last_reports.get(key)
+        if entry is not None:
+            _last_reports.move_to_end(key)
+        age = time.monotonic() - entry[2] if entry else None
+        stale = entry is not None and OPEN_RANGE_TTL <= age < 2 * OPEN_RANGE_TTL
+        if stale and key not in _refreshing:
+            _refreshing.add(key)
+            threading.Thread(target=_refresh_report, args=(date_from, date_to), daemon=True).start()
+    if stale:
+        return entry[0], entry[1]
+    return _fetch_report(date_from, date_to)
+
+def _prune_last_reports():
+    """Bỏ báo cáo đã quá 2 TTL (không còn được trả lại) và giữ tối đa LAST_REPORTS_MAX khoảng (gọi khi đang giữ lock)"""
+    now = time.monotonic()
+    for key in [k for k, entry in _last_reports.items() if now - entry[2] >= 2 * OPEN_RANGE_TTL]:
+        del _last_reports[key]
+    while len(_last_reports) > LAST_REPORTS_MAX:
+        _last_reports.popitem(last=False)
+
+def clear_last_reports():
+    """Bỏ các báo cáo cũ giữ cho stale-while-revalidate (dùng cùng st.cache_data.clear())"""
+    with _last_reports_lock:
+        _last_reports.clear()
+
+def _refresh_report(date_from: Optional[date], date_to: Optional[date]):
+    """Chạy lại pipeline ở thread nền (không gắn ScriptRunContext nên không vẽ progress lên trang)"""
+    try:
+        _fetch_report(date_from, date_to)
+    except Exception:
+        pass  # Giữ báo cáo cũ, lần gọi sau sẽ thử lại
+    finally:
+        with _last_reports_lock:
+            _refreshing.discard((date_from, date_to))
+
+def _is_closed_range(date_to: Optional[date]) -> bool:
+    """Khoảng đã đóng: kết thúc trước hôm nay nên dữ liệu gần như cố định"""
+    return bool(date_to) and date_to < date.today()
+
+def _fetch_report(date_from: Optional[date], date_to: Optional[date]) -> Tuple[Dict, List]:
+    """Gọi hàm cache theo loại khoảng ngày (khoảng đã đóng cache 1 giờ, còn mở cache 5 phút)"""
+    if _is_closed_range(date_to):
+        try:
+            report, filtered_threads = _fetch_closed_range(date_from, date_to)
+        except _UncachedResult:
+            return None, []
+    else:
+        # Token theo giờ: key cache của khoảng còn mở đổi mỗi giờ (và qua ngày) kể cả khi TTL chưa hết
+        return _fetch_open_range(date_from, date_to, datetime.now().strftime("%Y%m%d%H"))
+    return report, filtered_threads
+
+def _remember_report(date_from: Optional[date], date_to: Optional[date], report: Dict, filtered_threads: List):
+    """Ghi lại báo cáo vừa fetch thật (gọi trong hàm cache nên cache hit không làm mới timestamp)"""
+    if report is not None:
+        with _last_reports_lock:
+            key = (date_from, date_to)
+            _last_reports[key] = (report, filtered_threads, time.monotonic())
+            _last_reports.move_to_end(key)
+            _prune_last_reports()
+
+# Thread cập nhật hôm nay rời khỏi khoảng cũ nên chỉ cache CLOSED_RANGE_TTL (trễ tối đa 1 giờ);
+# chỉ cache trong bộ nhớ vì báo cáo chứa email/SĐT/tham số tool call
+@st.cache_data(ttl=CLOSED_RANGE_TTL)  # Cache 1 giờ
+def _fetch_closed_range(date_from: Optional[date], date_to: date) -> Tuple[Dict, List]:
+    """Fetch và analyze threads cho khoảng đã kết thúc (lỗi thì raise để không bị cache)"""
+    report, filtered_threads = _fetch_and_analyze(date_from, date_to)
+    if report is None:
+        raise _UncachedResult()
+    return report, filtered_threads
+
+@st.cache_data(ttl=OPEN_RANGE_TTL)  # Cache 5 phút
+def _fetch_open_range(date_from: Optional[date], date_to: Optional[date], bucket: str) -> Tuple[Dict, List]:
+    """Fetch và analyze threads cho khoảng còn chứa hôm nay (bucket chỉ dùng làm key cache)"""
+    report, filtered_threads = _fetch_and_analyze(date_from, date_to)
+    _remember_report(date_from, date_to, report, filtered_threads)
+    return report, filtered_threads
+
+def _fetch_and_analyze(date_from: Optional[date] = None, date_to: Optional[date] = None) -> Tuple[Dict, List]:
     """Fetch và analyze threads theo khoảng thời gian"""
     try:
-        analytics = ThreadAnalytics()
+        analytics = get_analytics()
         
         # Fetch all threads với progress
         progress_container = st.container()
@@ -95,39 +213,20 @@ def fetch_and_analyze_threads(date_from: Optional[date] = None, date_to: Optiona
             progress_bar.progress(0.2)
             status_text.text("📡 Đang gọi API threads/search...")
             
-            all_threads = analytics.fetch_all_threads()  # Không giới hạn số lượng thread
+            # Lấy từng trang và lọc theo ngày ngay trên trang đó, không giữ toàn bộ threads trong bộ nhớ
+            total_threads = 0
+            filtered_threads = []
+            for page in analytics.iter_thread_pages():  # Không giới hạn số lượng thread
+                total_threads += len(page)
+                filtered_threads.extend(filter_threads_by_updated_date(page, date_from, date_to))
+                status_text.text(f"📡 Đang gọi API threads/search... ({total_threads} threads)")
             
-            if not all_threads:
+            if not total_threads:
                 st.error("❌ Không thể lấy dữ liệu từ API hoặc không có threads")
                 return None, []
             
-            progress_bar.progress(0.5)
-            status_text.text(f"✅ Đã lấy được {len(all_threads)} threads")
-        
-        # Filter threads by date if specified
-        filtered_threads = []
-        if date_from or date_to:
             progress_bar.progress(0.7)
-            status_text.text("📅 Đang lọc dữ liệu theo ngày...")
-            
-            for thread in all_threads:
-                updated_at = thread.get('updated_at')
-                if updated_at:
-                    try:
-                        dt = datetime.fromisoformat(updated_at.replace('Z', '+00:00'))
-                        thread_date = dt.date()
-                        
-                        # Check date range
-                        if date_from and thread_date < date_from:
-                            continue
-                        if date_to and thread_date > date_to:
-                            continue
-                            
-                        filtered_threads.append(thread)
-                    except (ValueError, AttributeError):
-                        continue
-        else:
-            filtered_threads = all_threads
+            status_text.text(f"✅ Đã lấy được {total_threads} threads")
         
         if not filtered_threads:
             st.warning("⚠️ Không có dữ liệu trong khoảng thời gian đã chọn")
@@ -152,47 +251,61 @@ def fetch_and_analyze_threads(date_from: Optional[date] = None, date_to: Optiona
         st.exception(e)  # Show full error for debugging
         return None, []
 
-@st.cache_data(ttl=300)
 def get_conversations_for_threads(threads: List[dict]) -> List[dict]:
-    """Lấy conversations cho các threads"""
+    """Lấy conversations cho các threads (tải history song song)"""
+    # Key cache chỉ gồm (thread_id, updated_at): không phải hash toàn bộ dict thread (kèm values/messages)
+    thread_key = tuple((thread.get('thread_id'), thread.get('updated_at')) for thread in threads)
+    return _fetch_conversations(thread_key, threads)
+
+@st.cache_data(ttl=300)
+def _fetch_conversations(thread_key: Tuple, _threads: List[dict]) -> List[dict]:
+    """Tải history song song cho các threads (cache theo thread_key)"""
+    threads = _threads
     try:
-        analytics = ThreadAnalytics()
-        conversations = []
+        analytics = get_analytics()
         
         # Progress tracking
         progress_container = st.container()
         with progress_container:
+            threads_with_id = [thread for thread in threads if thread.get('thread_id')]
+            total_threads = len(threads_with_id)
             st.info(f"💬 Đang lấy conversations cho {len(threads)} threads...")
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            total_threads = len(threads)
-            
-            for i, thread in enumerate(threads):
-                thread_id = thread.get('thread_id')
-                if not thread_id:
-                    continue
-                
-                # Update progress
-                progress = (i + 1) / total_threads
-                progress_bar.progress(progress)
-                status_text.text(f"💬 Xử lý thread {i+1}/{total_threads}: {thread_id[:16]}...")
-                
-                # Get conversation
-                history_data = analytics.get_thread_history(thread_id)
-                if history_data:
-                    conversation = analytics.extract_conversation_from_history(history_data)
+            # Worker chỉ gọi HTTP; parse conversation + cập nhật progress ở main thread
+            conversations_by_index = {}
+            with ThreadPoolExecutor(max_workers=CONVERSATION_FETCH_WORKERS) as executor:
+                future_to_index = {
+                    executor.submit(analytics.get_thread_history, thread['thread_id']): i
+                    for i, thread in enumerate(threads_with_id)
+                }
+                for done, future in enumerate(as_completed(future_to_index), 1):
+                    i = future_to_index[future]
+                    thread = threads_with_id[i]
+                    thread_id = thread['thread_id']
                     
-                    if conversation:
-                        conv_data = {
-                            'thread_id': thread_id,
-                            'created_at': thread.get('created_at', ''),
-                            'updated_at': thread.get('updated_at', ''),
-                            'message_count': len(conversation),
-                            'conversation': conversation,
-                            'metadata': thread.get('metadata', {})
-                        }
-                        conversations.append(conv_data)
+                    # Update progress
+                    progress_bar.progress(done / total_threads)
+                    status_text.text(f"💬 Xử lý thread {done}/{total_threads}: {thread_id[:16]}...")
+                    
+                    # Get conversation
+                    history_data = future.result()
+                    if history_data:
+                        conversation = analytics.extract_conversation_from_history(history_data)
+                        
+                        if conversation:
+                            conversations_by_index[i] = {
+                                'thread_id': thread_id,
+                                'created_at': thread.get('created_at', ''),
+                                'updated_at': thread.get('updated_at', ''),
+                                'message_count': len(conversation),
+                                'conversation': conversation,
+                                'metadata': thread.get('metadata', {})
+                            }
+            
+            # Giữ thứ tự threads đầu vào
+            conversations = [conversations_by_index[i] for i in sorted(conversations_by_index)]
             
             progress_bar.progress(1.0)
             status_text.text("✅ Hoàn tất tải conversations!")
@@ -206,6 +319,15 @@ def get_conversations_for_threads(threads: List[dict]) -> List[dict]:
         st.error(f"❌ Lỗi khi lấy conversations: {str(e)}")
         return []
 
+def _clear_cache():
+    """Callback nút "Xóa Cache": xóa cache dữ liệu, báo cáo cũ và toàn bộ session state"""
+    st.cache_data.clear()
+    clear_last_reports()
+    # Figure Plotly trong state có tham chiếu vòng nên gom rác luôn
+    st.session_state.clear()
+    gc.collect()
+    st.session_state['cache_cleared'] = True
+
 def analytics_page():
     """Main function for Analytics page"""
     st.title("📊 Tebbi AI Analytics Dashboard")
@@ -227,17 +349,14 @@ def analytics_page():
         analyze_button = st.button("🚀 Bắt Đầu Thống Kê", type="primary", use_container_width=True)
     
     with col2:
-        if st.button("🗑️ Xóa Cache", help="Xóa cache để lấy dữ liệu mới"):
-            st.cache_data.clear()
-            # Clear all session state
-            for key in list(st.session_state.keys()):
-                del st.session_state[key]
+        # Xóa trong callback (chạy trước lần rerun do click) nên không cần st.rerun() thêm lần nữa
+        st.button("🗑️ Xóa Cache", help="Xóa cache để lấy dữ liệu mới", on_click=_clear_cache)
+        if st.session_state.pop('cache_cleared', False):
             st.success("✅ Cache đã được xóa")
-            st.rerun()
     
     with col3:
-        if st.button("🔄 Refresh Page", help="Làm mới trang"):
-            st.rerun()
+        # Bản thân click đã kích hoạt rerun
+        st.button("🔄 Refresh Page", help="Làm mới trang")
     
     # Analyze data when button clicked
     if analyze_button:
@@ -276,12 +395,19 @@ def analytics_page():
         analysis_params = st.session_state.get('analysis_params', {})
         
         # Show analysis info
+        debug_line = (
+            f"<br>🟢 <b>Debug:</b> Đã lấy {len(filtered_threads)} threads, phân tích {report_data.get('summary', {}).get('total_threads', 0)} threads"
+            if DEBUG_UI else ""
+        )
+        stale_line = (
+            f"<br>ℹ️ Khoảng đã qua được cache tối đa {CLOSED_RANGE_TTL // 60} phút: thread vừa được cập nhật có thể vẫn còn trong kết quả"
+            if _is_closed_range(analysis_params.get('date_to')) else ""
+        )
         st.markdown(f"""
         <div class="success-box">
             📊 <strong>Kết quả phân tích:</strong> {len(filtered_threads)} threads<br>
             📅 <strong>Thời gian:</strong> {analysis_params.get('date_from')} ➜ {analysis_params.get('date_to')}<br>
-            ⏰ <strong>Thời điểm phân tích:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}<br>
-            🟢 <b>Debug:</b> Đã lấy {len(st.session_state.get('filtered_threads', []))} threads, phân tích {report_data.get('summary', {}).get('total_threads', 0)} threads
+            ⏰ <strong>Thời điểm phân tích:</strong> {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}{stale_line}{debug_line}
         </div>
         """, unsafe_allow_html=True)
         
@@ -334,7 +460,7 @@ def analytics_page():
         st.markdown("---")
         st.markdown("### 🔗 API Connection")
         try:
-            analytics = ThreadAnalytics()
+            analytics = get_analytics()
             st.success("✅ API Ready")
         except Exception as e:
             st.error("❌ API Error")
@@ -6,7 +6,7 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime, date, timedelta
 import plotly.express as px
-from utils.odoo_utils import get_odoo_leads, TAG_IDS, STAGE_IDS, map_tags, map_stage
+from utils.odoo_utils import get_odoo_leads, TAG_IDS, STAGE_IDS, explode_tag_names, map_stage
 
 def odoo_lead_page():
     """Main function for Odoo Leads page"""
@@ -94,17 +94,16 @@ def odoo_lead_page():
                 st.plotly_chart(fig_pie, use_container_width=True)
 
                 # By tag (map to names)
-                df['tag_names'] = df['tag_ids'].apply(map_tags)
-                tag_exploded = df.explode('tag_names')
-                tag_counts = tag_exploded['tag_names'].value_counts().reset_index()
+                tag_names = explode_tag_names(df['tag_ids'])
+                tag_counts = tag_names.value_counts().reset_index()
                 tag_counts.columns = ['Tag', 'Leads']
                 fig3 = px.bar(tag_counts, x='Tag', y='Leads', title='Số lượng lead theo tag', color='Leads', color_continuous_scale='Blues')
                 fig3.update_layout(margin=dict(l=10, r=10, t=40, b=10), height=320)
                 st.plotly_chart(fig3, use_container_width=True)
                 # Mapping stage_id sang tên
-                df['stage_name'] = df['stage_id'].apply(map_stage)
+                df['stage_name'] = df['stage_id'].map(map_stage)
                 # Hiển thị bảng dữ liệu lead trực tiếp
-                df['tag_names'] = df['tag_names'].apply(lambda x: ', '.join(x) if isinstance(x, list) else str(x))
+                df['tag_names'] = tag_names.groupby(level=0).agg(', '.join).reindex(df.index, fill_value='')
                 # Thêm cột Creator chỉ lấy tên người tạo
                 def extract_creator_name(create_uid):
                     if isinstance(create_uid, list) and len(create_uid) > 1:
@@ -139,7 +138,8 @@ def odoo_lead_page():
                     label="📥 Tải bảng dữ liệu CSV",
                     data=csv,
                     file_name=f"odoo_leads_{datetime.now().strftime('%Y%m%d_%H%M')}.csv",
-                    mime="text/csv"
+                    mime="text/csv",
+                    key="download_odoo_leads"
                 )
             else:
                 st.warning('Không có dữ liệu lead phù hợp!') 
\ No newline at end of file